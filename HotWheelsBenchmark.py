@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from PIL import Image
+import HotWheelsCore
+from HotWheelsCore import (Car, Catalog, DEFAULT_BRANDS, LOAD_FIRST_BATCH, ingest_image, create_thumbnail, save_catalog,
+                           save_brands, ensure_dirs, reset_catalog_store, export_cars, SearchIndex)
+
+BENCH_SIZES = (1000, 10000, 100000, 1000000)
+BENCH_REPEAT = 3
+BENCH_SEED = 1234
+BENCH_BRANDS = tuple(DEFAULT_BRANDS) + tuple(f"Brand {i:02d}" for i in range(1, 18))
+BENCH_IMAGES = 32
+BENCH_IMAGE_SIZE = (1200, 900)
+BENCH_THUMBNAIL_SOURCES = 8
+BENCH_WORDS = ("twin", "mill", "bone", "shaker", "custom", "turbo", "classic", "rally", "drift", "coupe", "wagon",
+               "pickup", "roadster", "muscle", "concept", "racer", "police", "taxi", "van", "truck")
+BENCH_QUERIES = ("model 12", "brand:matchbox", "turbo 1998", "notes:rally")
+BENCH_RANGES = {"year": (1990, 2000), "internet_value": (10, None)}
+BENCH_EDIT_COUNT = 100
+BENCH_EXPORT_FORMATS = ("csv", "jsonl", "html")
+BENCH_THRESHOLD = 1.2
+BENCH_OUTPUT = "benchmark.json"
+XVFB_DISPLAY = ":99"
+
+
+def make_source_images(folder, count):
+    # Noise under a tint decodes and compresses like a photo rather than a flat fill.
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(BENCH_SEED)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"source_{i:03d}.jpg")
+        tint = tuple(rng.randrange(256) for _ in range(3))
+        if not os.path.exists(path):
+            noise = Image.effect_noise(BENCH_IMAGE_SIZE, 48).convert("RGB")
+            Image.blend(noise, Image.new("RGB", BENCH_IMAGE_SIZE, tint), 0.6).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def synthetic_car(rng, index, images):
+    image, thumb, phash = rng.choice(images)
+    return Car.from_dict({
+        "brand": rng.choice(BENCH_BRANDS),
+        "model": f"Model {index} {rng.choice(BENCH_WORDS).title()}",
+        "year": float(rng.randint(1968, 2024)),
+        "bought_value": round(rng.uniform(0.5, 30.0), 2),
+        "internet_value": round(rng.lognormvariate(1.5, 1.0), 2),
+        "notes": " ".join(rng.sample(BENCH_WORDS, 2)) if rng.random() < 0.5 else "",
+        "open_state": "Open" if rng.random() < 0.3 else "Cased",
+        "image": image,
+        "thumb": thumb,
+        "phash": phash,
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+    })
+
+
+def generate_catalog(size, sources):
+    # Runs in the catalog's directory. The sources are ingested into IMAGE_DIR and THUMB_DIR and
+    # shared between the cars, as duplicated and re-imported cars share them in a real catalog.
+    ensure_dirs()
+    images = [ingest_image(path) for path in sources]
+    rng = random.Random(BENCH_SEED)
+    save_catalog([synthetic_car(rng, i, images) for i in range(size)])
+    save_brands(list(BENCH_BRANDS))
+
+
+def timings(fn, repeat, teardown=None):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+        if teardown is not None:
+            teardown()
+    return {"median_ms": round(statistics.median(runs) * 1000, 3), "min_ms": round(min(runs) * 1000, 3),
+            "runs": len(runs)}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def search_index_mb(cars):
+    # Traced apart from the timings, which tracing would slow down.
+    tracemalloc.start()
+    try:
+        index = SearchIndex(cars)
+        return round(tracemalloc.get_traced_memory()[0] / 2 ** 20, 1)
+    finally:
+        del index
+        tracemalloc.stop()
+
+
+def bench_core(repeat):
+    results = {}
+    results["load_catalog"] = timings(Catalog, repeat)
+
+    def first_batch():
+        catalog = Catalog(stream=True)
+        catalog.add_loaded(*catalog.read_batch(LOAD_FIRST_BATCH))
+
+    results["first_batch"] = timings(first_batch, repeat)
+    catalog = Catalog()
+    results["search"] = timings(lambda: [catalog.query(query) for query in BENCH_QUERIES], repeat)
+    results["filter_sort"] = timings(
+        lambda: catalog.query("", BENCH_RANGES, sort="internet_value", reverse=True), repeat)
+    edited = catalog.cars[:BENCH_EDIT_COUNT]
+    results["save_catalog_partial"] = timings(lambda: save_catalog(catalog.cars, edited), repeat)
+    results["save_catalog_full"] = timings(lambda: save_catalog(catalog.cars), repeat)
+
+    def export(fmt):
+        # Into a folder removed after every run, so the gallery copies its thumbnails each time.
+        os.makedirs("export", exist_ok=True)
+        export_cars(catalog.cars, os.path.join("export", f"cars.{fmt}"))
+
+    for fmt in BENCH_EXPORT_FORMATS:
+        results[f"export_{fmt}"] = timings(lambda: export(fmt), repeat, teardown=lambda: shutil.rmtree("export"))
+    results["search_index_mb"] = search_index_mb(catalog.cars)
+    return results
+
+
+def bench_thumbnails(sources, repeat, folder):
+    sources = sources[:BENCH_THUMBNAIL_SOURCES]
+    thumb_path = os.path.join(folder, "bench_thumb.jpg")
+    return {"create_thumbnail": timings(lambda: [create_thumbnail(path, thumb_path) for path in sources], repeat),
+            "create_thumbnail_count": len(sources)}
+
+
+def close_tabs(app, keep):
+    for tab_id in app.notebook.tabs():
+        if tab_id not in keep:
+            tab = app.root.nametowidget(tab_id)
+            app.close_tab(tab)
+            tab.destroy()
+
+
+def bench_gui(repeat):
+    import tkinter as tk
+    import HotWheelsCatalog
+    results = {}
+    root = tk.Tk()
+    try:
+        root.geometry("1024x768")
+        start = time.perf_counter()
+        app = HotWheelsCatalog.HotWheelsApp(root)
+        # Streaming the catalog in and the startup image check both finish on the event loop.
+        while app.catalog.loading or app.jobs.pending:
+            root.update()
+        root.update()
+        startup = round((time.perf_counter() - start) * 1000, 3)
+        results["gui_startup"] = {"median_ms": startup, "min_ms": startup, "runs": 1}
+        keep = set(app.notebook.tabs())
+
+        results["refresh_catalog"] = timings(lambda: [app.refresh_catalog(), root.update_idletasks()], repeat)
+
+        def search():
+            app.search_var.set(BENCH_QUERIES[0])
+            app.apply_search()
+            root.update_idletasks()
+
+        def clear_search():
+            app.search_var.set("")
+            app.apply_search()
+            root.update_idletasks()
+
+        results["apply_search"] = timings(search, repeat, clear_search)
+        brand = max(BENCH_BRANDS, key=app.catalog.brands.count)
+        results["open_brand_tab"] = timings(lambda: [app.open_brand_tab(brand), root.update_idletasks()], repeat,
+                                            lambda: close_tabs(app, keep))
+        car = app.catalog.cars[len(app.catalog.cars) // 2]
+        results["open_detail_tab"] = timings(lambda: [app.open_detail_tab(car), root.update_idletasks()], repeat,
+                                             lambda: close_tabs(app, keep))
+    finally:
+        root.destroy()
+    return results
+
+
+def start_display():
+    # Returns the Xvfb process started (or None) and why the Tk benchmarks cannot run (or None).
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None, None
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        return None, "no DISPLAY and Xvfb is not installed"
+    process = subprocess.Popen([xvfb, XVFB_DISPLAY, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket = f"/tmp/.X11-unix/X{XVFB_DISPLAY[1:]}"
+    for _ in range(50):
+        if os.path.exists(socket):
+            os.environ["DISPLAY"] = XVFB_DISPLAY
+            return process, None
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    process.kill()
+    return None, "Xvfb failed to start"
+
+
+def run(args):
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+               "platform": platform.platform(), "backend": args.backend, "repeat": args.repeat,
+               "sizes": {}, "skipped": {}}
+    HotWheelsCore.STORAGE_BACKEND = args.backend
+    os.makedirs(args.workdir, exist_ok=True)
+    sources = make_source_images(os.path.join(args.workdir, "sources"), BENCH_IMAGES)
+    results["images"] = bench_thumbnails(sources, args.repeat, args.workdir)
+
+    display, gui_skipped = (None, "--no-gui") if args.no_gui else start_display()
+    if gui_skipped:
+        results["skipped"]["gui"] = gui_skipped
+    cwd = os.getcwd()
+    try:
+        for size in args.sizes:
+            # The store is opened relative to the working directory, so every catalog gets its own.
+            folder = os.path.join(args.workdir, f"cars-{args.backend}-{size}")
+            if args.regenerate and os.path.exists(folder):
+                shutil.rmtree(folder)
+            os.makedirs(folder, exist_ok=True)
+            os.chdir(folder)
+            reset_catalog_store()
+            if not os.path.exists("generated.json"):
+                print(f"Generating {size} cars in {folder}...", file=sys.stderr)
+                generate_catalog(size, sources)
+                with open("generated.json", 'w') as f:
+                    json.dump({"size": size, "seed": BENCH_SEED}, f)
+            print(f"Benchmarking {size} cars...", file=sys.stderr)
+            timing = bench_core(args.repeat)
+            if not gui_skipped:
+                timing.update(bench_gui(args.repeat))
+            timing["peak_rss_mb"] = peak_rss_mb()
+            results["sizes"][str(size)] = timing
+            os.chdir(cwd)
+            reset_catalog_store()
+    finally:
+        os.chdir(cwd)
+        reset_catalog_store()
+        if display is not None:
+            display.terminate()
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Yields (group, operation, baseline ms or None, current ms, ratio or None, verdict).
+    groups = [("images", results["images"])] + list(results["sizes"].items())
+    base_groups = dict([("images", baseline.get("images", {}))] + list(baseline.get("sizes", {}).items()))
+    for group, operations in groups:
+        for name, timing in operations.items():
+            if not isinstance(timing, dict):
+                continue
+            base = base_groups.get(group, {}).get(name)
+            if not base or not base["median_ms"]:
+                yield group, name, None, timing["median_ms"], None, ""
+                continue
+            ratio = timing["median_ms"] / base["median_ms"]
+            verdict = "SLOWER" if ratio > threshold else "faster" if ratio < 1 / threshold else ""
+            yield group, name, base["median_ms"], timing["median_ms"], ratio, verdict
+
+
+def print_results(rows):
+    print(f"{'size':>8} {'operation':<22} {'baseline ms':>12} {'median ms':>12} {'ratio':>7}")
+    for group, name, base, current, ratio, verdict in rows:
+        base = f"{base:12.2f}" if base is not None else f"{'-':>12}"
+        ratio = f"{ratio:7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{group:>8} {name:<22} {base} {current:12.2f} {ratio} {verdict}".rstrip())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Time loading, searching, refreshing and saving synthetic catalogs, optionally against a baseline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(BENCH_SIZES), help="catalog sizes in cars")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT, help="runs per operation; the median is reported")
+    parser.add_argument("--backend", choices=("sqlite", "json", "shards"), default=HotWheelsCore.STORAGE_BACKEND)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "hotwheels-benchmark"),
+                        help="where the generated catalogs are kept between runs")
+    parser.add_argument("--regenerate", action="store_true", help="generate the catalogs again")
+    parser.add_argument("--no-gui", action="store_true", help="skip the Tk benchmarks")
+    parser.add_argument("--output", default=BENCH_OUTPUT, help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD,
+                        help="slowdown ratio reported as a regression")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.workdir = os.path.abspath(args.workdir)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    results = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for part, reason in results["skipped"].items():
+        print(f"skipped {part}: {reason}", file=sys.stderr)
+    rows = list(compare(results, baseline or {}, args.threshold))
+    print_results(rows)
+    for size, timing in results["sizes"].items():
+        print(f"{size:>8} search index {timing['search_index_mb']} MB, peak RSS so far {timing['peak_rss_mb']} MB")
+    # A non-zero exit lets CI fail on a regression.
+    return 1 if any(verdict == "SLOWER" for *row, verdict in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import argparse
+import sys
+from HotWheelsCore import (Catalog, CAR_FIELDS, NUMERIC_FIELDS, EXPORT_FORMATS, EXPORT_PROGRESS_EVERY,
+                           parse_car_fields, export_cars, bulk_import, clear_import_progress, scan_images,
+                           backfill_hashes, profiler, PROFILE_FILE, PROFILE_STATS_FILE)
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def print_cars(cars, limit=None):
+    for i, car in enumerate(cars):
+        if limit is not None and i >= limit:
+            print(f"... {len(cars) - limit} more")
+            break
+        print("\t".join([car["id"]] + [format_value(car.get(key, "")) for key in CAR_FIELDS]))
+
+
+def parse_range(text):
+    low, sep, high = text.partition(":")
+    try:
+        if not sep:
+            raise ValueError
+        return float(low) if low.strip() else None, float(high) if high.strip() else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected LOW:HIGH with either side optional, got '{text}'")
+
+
+def add_filter_arguments(command):
+    for field in NUMERIC_FIELDS:
+        command.add_argument("--" + field.replace("_", "-"), dest=field, type=parse_range, metavar="LOW:HIGH")
+    command.add_argument("--opened", action="store_true", help="only cars out of their case")
+    command.add_argument("--sort", choices=("brand",) + NUMERIC_FIELDS)
+    command.add_argument("--desc", action="store_true", help="sort descending")
+    command.add_argument("--limit", type=int)
+
+
+def query_cars(catalog, args, text="", brand=None):
+    ranges = {field: getattr(args, field) for field in NUMERIC_FIELDS if getattr(args, field)}
+    return catalog.query(text, ranges, args.opened, brand, args.sort, args.desc)
+
+
+def cmd_list(catalog, args):
+    print_cars(query_cars(catalog, args, brand=args.brand), args.limit)
+
+
+def cmd_search(catalog, args):
+    print_cars(query_cars(catalog, args, " ".join(args.query)), args.limit)
+
+
+def cmd_add(catalog, args):
+    values = {key: getattr(args, key) for key in CAR_FIELDS if key != "open_state"}
+    values["open_state"] = "Open" if args.open else "Cased"
+    data = parse_car_fields(values)
+    if data["brand"] not in catalog.brands:
+        catalog.add_brand(data["brand"])
+    car = catalog.add_car(data, args.image)
+    print(car["id"])
+    for other in catalog.similar_cars(car):
+        print(f"warning: image looks like {other['id']} ({other['brand']} {other['model']})", file=sys.stderr)
+
+
+def cmd_import(catalog, args):
+    def report(done, total, rate):
+        print(f"\rImporting {done}/{total} ({rate:.1f} images/sec)", end="", file=sys.stderr, flush=True)
+
+    records, failures, rate = bulk_import(args.source, args.brand or catalog.brands.first(), report)
+    print(file=sys.stderr)
+    catalog.add_records(records)
+    catalog.flush()
+    if not catalog.dirty:
+        clear_import_progress()
+    print(f"Imported {len(records)} car(s) at {rate:.1f} images/sec.")
+    for failure in failures:
+        print(f"failed: {failure}", file=sys.stderr)
+
+
+def cmd_export(catalog, args):
+    def report(done, total):
+        print(f"\rExporting {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    cars = query_cars(catalog, args, args.query or "", args.brand)
+    if args.limit is not None:
+        cars = cars[:args.limit]
+    count = export_cars(cars, args.path, args.format, report)
+    if count >= EXPORT_PROGRESS_EVERY:
+        print(file=sys.stderr)
+    print(f"Exported {count} car(s) to {args.path}.")
+
+
+def cmd_stats(catalog, args):
+    stats = catalog.stats()
+    print(f"Cars:           {stats['count']} ({stats['states']['Cased']} cased, {stats['states']['Open']} open)")
+    print(f"Bought value:   {stats['bought_value']:.2f}")
+    print(f"Internet value: {stats['internet_value']:.2f}")
+    print(f"Gain/loss:      {stats['gain']:+.2f}")
+    print("By brand:")
+    for brand in sorted(stats["brands"]):
+        entry = stats["brands"][brand]
+        print(f"  {brand}: {entry['count']} car(s), bought {entry['bought_value']:.2f}, "
+              f"internet {entry['internet_value']:.2f}, gain {entry['gain']:+.2f}")
+    print("By year:")
+    for year, count in stats["years"].items():
+        print(f"  {year or 'unknown'}: {count}")
+    print("By internet value:")
+    for label, count in stats["values"]:
+        print(f"  {label}: {count}")
+
+
+def cmd_check(catalog, args):
+    def report(done, total):
+        print(f"\rChecking {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    result = scan_images(list(catalog.images.refs), report)
+    if result["checked"]:
+        print(file=sys.stderr)
+    print(f"Checked {result['checked']} changed image(s) of {len(catalog.images.refs)}.")
+    for name in result["repaired"]:
+        print(f"rebuilt thumbnail: {name}")
+    for name in result["missing"]:
+        print(f"missing: {name}")
+    for error in result["damaged"]:
+        print(f"damaged: {error}")
+    orphans = result["orphans"]
+    if args.clean:
+        removed = catalog.remove_orphans(orphans)
+        print(f"Removed {len(removed)} orphaned file(s).")
+    else:
+        for path in orphans:
+            print(f"orphan: {path}")
+        if orphans:
+            print(f"{len(orphans)} orphaned file(s) ({result['orphan_bytes'] / (1024 * 1024):.1f} MB); "
+                  f"remove them with --clean.")
+
+
+def cmd_duplicates(catalog, args):
+    def report(done, total):
+        print(f"\rIndexing {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    # Images stored before hashes were taken at ingest are hashed (and the hashes saved) first.
+    names = catalog.unhashed_images()
+    if names:
+        hashes, failures = backfill_hashes(names, report)
+        print(file=sys.stderr)
+        catalog.set_hashes(hashes)
+        for failure in failures:
+            print(f"unreadable: {failure}", file=sys.stderr)
+    groups = catalog.find_duplicates()
+    for i, cars in enumerate(groups, 1):
+        print(f"Group {i}: {len(cars)} cars")
+        print_cars(cars)
+    print(f"{len(groups)} group(s) of likely duplicates.")
+
+
+def print_profile(summary):
+    print(f"{'span':<20} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'total ms':>11}", file=sys.stderr)
+    for name, span in summary["spans"].items():
+        print(f"{name:<20} {span['count']:>7} {span['p50_ms']:>10.3f} {span['p95_ms']:>10.3f} {span['max_ms']:>10.3f} "
+              f"{span['total_ms']:>11.3f}", file=sys.stderr)
+    for name, value in summary["counters"].items():
+        print(f"{name}: {value}", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Query and maintain the Hot Wheels catalog without the GUI.")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"print timings to stderr and write them to {PROFILE_FILE} and {PROFILE_STATS_FILE}")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("list", help="list cars, optionally of one brand")
+    command.add_argument("--brand")
+    add_filter_arguments(command)
+    command.set_defaults(func=cmd_list)
+
+    command = commands.add_parser("search", help="search with the same syntax as the GUI, e.g. brand:matchbox 1998")
+    command.add_argument("query", nargs="+")
+    add_filter_arguments(command)
+    command.set_defaults(func=cmd_search)
+
+    command = commands.add_parser("add", help="add a car and print its id")
+    command.add_argument("brand")
+    command.add_argument("model")
+    command.add_argument("--year", default="")
+    command.add_argument("--bought-value", dest="bought_value", default="")
+    command.add_argument("--internet-value", dest="internet_value", default="")
+    command.add_argument("--notes", default="")
+    command.add_argument("--open", action="store_true", help="the car is out of its case")
+    command.add_argument("--image", help="image file to copy in; a placeholder is used otherwise")
+    command.set_defaults(func=cmd_add)
+
+    command = commands.add_parser("import", help="bulk import a folder of images or a CSV/JSON manifest")
+    command.add_argument("source")
+    command.add_argument("--brand", help="brand for rows that do not name one")
+    command.set_defaults(func=cmd_import)
+
+    command = commands.add_parser("export", help="export cars to CSV, JSON, JSON Lines or an HTML gallery")
+    command.add_argument("path")
+    command.add_argument("--format", choices=EXPORT_FORMATS, help="defaults to the file extension")
+    command.add_argument("--query", help="only export cars matching this search")
+    command.add_argument("--brand")
+    add_filter_arguments(command)
+    command.set_defaults(func=cmd_export)
+
+    command = commands.add_parser("stats", help="print totals and per-brand statistics")
+    command.set_defaults(func=cmd_stats)
+
+    command = commands.add_parser("check", help="check stored images, rebuild missing thumbnails, report orphans")
+    command.add_argument("--clean", action="store_true", help="delete orphaned image files")
+    command.set_defaults(func=cmd_check)
+
+    command = commands.add_parser("duplicates", help="list groups of cars with near-identical images")
+    command.set_defaults(func=cmd_duplicates)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        profiler.start_capture()
+    try:
+        catalog = Catalog(lazy_indexes=True)
+        args.func(catalog, args)
+        catalog.close()
+    except (ValueError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.profile:
+            profiler.stop_capture()
+            print_profile(profiler.export())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,61 +1,565 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, simpledialog
+from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 import os
-import json
-import uuid
-import shutil
-
-DATA_FILE = "catalog.json"
-BRAND_FILE = "brands.json"
-IMAGE_DIR = "images"
-THUMB_DIR = os.path.join(IMAGE_DIR, "thumbs")
-THUMB_SIZE = (100, 100)
-
-os.makedirs(THUMB_DIR, exist_ok=True)
-
-DEFAULT_BRANDS = ["HotWheels", "Matchbox", "Majorette"]
-
-
-def load_catalog():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-
-def save_catalog(catalog):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(catalog, f, indent=4)
-
-
-def load_brands():
-    if os.path.exists(BRAND_FILE):
-        with open(BRAND_FILE, 'r') as f:
-            return json.load(f)
-    return DEFAULT_BRANDS.copy()
-
-
-def save_brands(brand_list):
-    with open(BRAND_FILE, 'w') as f:
-        json.dump(brand_list, f, indent=4)
-
-
-def create_thumbnail(image_path, thumb_path):
-    img = Image.open(image_path)
-    img.thumbnail(THUMB_SIZE)
-    img.save(thumb_path)
+import bisect
+import sqlite3
+import argparse
+import queue
+import itertools
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from HotWheelsCore import (Catalog, THUMB_DIR, THUMB_SIZE, LOAD_FIRST_BATCH, LOAD_BATCH_SIZE, parse_car_fields,
+                           find_brand_logo, ingest_image, bulk_import, load_import_progress,
+                           clear_import_progress, open_image, load_rendition, scan_images, backfill_hashes,
+                           ThumbnailAtlas, thumb_name, export_cars, profiler, PROFILE_FILE, PROFILE_STATS_FILE)
+
+CARD_COLUMNS = 4
+CARD_WIDTH = 130
+CARD_HEIGHT = 140
+HEADER_HEIGHT = 40
+GRID_OVERSCAN = 2
+BRAND_PAGE_SIZE = 64
+CARD_BG = "#f0f0f0"
+CARD_HOVER_BG = "#cccccc"
+CARD_SELECTED_BG = "#cce4ff"
+SHIFT_MASK = 0x1
+CONTROL_MASK = 0x4
+
+SEARCH_DEBOUNCE_MS = 200
+PERSIST_IDLE_MS = 1500
+SORT_OPTIONS = {"Brand": None, "Year": "year", "Bought value": "bought_value", "Internet value": "internet_value"}
+RANGE_FILTERS = (("year", "Year"), ("internet_value", "Value"))
+STATS_TABLES = (("brands", ("Brand", "Cars", "Bought", "Internet", "Gain/loss")),
+                ("years", ("Year", "Cars")),
+                ("values", ("Internet value", "Cars", "")))
+STATS_BAR_WIDTH = 30
+PROFILE_COLUMNS = ("Span", "Count", "p50 ms", "p95 ms", "Max ms", "Total ms")
+BATCH_FIELDS = (("brand", "Brand", ("set",)),
+                ("open_state", "State", ("set",)),
+                ("year", "Year", ("set", "add")),
+                ("bought_value", "Bought value", ("set", "add", "percent")),
+                ("internet_value", "Internet value", ("set", "add", "percent")),
+                ("notes", "Notes", ("set", "append")))
+BATCH_OPERATION_LABELS = {"set": "Set to", "add": "Add", "percent": "Change by %", "append": "Append"}
+
+INGEST_WORKERS = 4
+JOB_POLL_MS = 50
+LOAD_SLICE_SIZE = 100
+LOAD_SLICE_MS = 10
+LOAD_REFRESH_MS = 1000
+
+DETAIL_IMAGE_SIZE = 300
+VIEWER_IMAGE_SIZE = 800
+BRAND_LOGO_SIZE = 160
+
+THUMB_CACHE_MAX_ENTRIES = 2000
+THUMB_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class BackgroundJobs:
+    # Runs work on a thread pool and hands results back to the Tk thread through a queue
+    # drained with root.after, since widgets may only be touched from the main loop.
+    def __init__(self, root, workers=INGEST_WORKERS, on_change=None):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.results = queue.Queue()
+        self.on_change = on_change
+        self.pending = 0
+        self._poll_job = None
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self.results.put(lambda: self._finish(f, on_done, on_error)))
+        self.pending += 1
+        self._changed()
+        if self._poll_job is None:
+            self._poll_job = self.root.after(JOB_POLL_MS, self._poll)
+        return future
+
+    def post(self, fn, *args):
+        # Safe to call from a worker thread; fn runs on the Tk thread at the next poll.
+        self.results.put(lambda: fn(*args))
+
+    def _finish(self, future, on_done, on_error):
+        self.pending -= 1
+        error = future.exception()
+        if error is None:
+            if on_done is not None:
+                on_done(future.result())
+        elif on_error is not None:
+            on_error(error)
+        self._changed()
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                callback = self.results.get_nowait()
+            except queue.Empty:
+                break
+            callback()
+        if self.pending:
+            self._poll_job = self.root.after(JOB_POLL_MS, self._poll)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.pending)
+
+
+_open_badge = None
+
+
+def open_badge():
+    global _open_badge
+    if _open_badge is None:
+        mask = Image.frombytes('L', (15, 15), bytes(
+            255 if (x - 7) ** 2 + (y - 7) ** 2 <= 49 else 0 for y in range(15) for x in range(15)))
+        _open_badge = Image.new('RGBA', (15, 15), (255, 0, 0, 0))
+        _open_badge.putalpha(mask)
+    return _open_badge
+
+
+def composite_open_badge(img):
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    badge = open_badge()
+    img.paste(badge, (img.width - 18, 3), badge)
+    return img
+
+
+def blank_image(size):
+    return Image.new('RGB', size, color=(200, 200, 200))
+
+
+def decoded_rendition(car, size):
+    # Decodes fully so a worker thread can do the work before the Tk thread wraps it.
+    img = load_rendition(car, size)
+    img.load()
+    return img
+
+
+class ThumbnailCache:
+    # PhotoImages keyed by (car id, thumb name, variant), evicted least recently used once either
+    # the entry or the byte budget is exceeded. Misses are served from the atlas when it has the
+    # tile; otherwise the thumbnail file is decoded once and added to it.
+    def __init__(self, atlas=None, max_entries=THUMB_CACHE_MAX_ENTRIES, max_bytes=THUMB_CACHE_MAX_BYTES):
+        self.atlas = atlas
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.keys_by_id = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, car, variant=None, decorate=None):
+        car_id = car["id"]
+        key = (car_id, car["thumb"], variant)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        with profiler.span("thumbnail_decode"):
+            img = self.atlas.get(car["thumb"]) if self.atlas is not None else None
+            if img is not None:
+                profiler.count("atlas_hits")
+            else:
+                try:
+                    img = Image.open(os.path.join(THUMB_DIR, car["thumb"]))
+                    img.load()
+                except OSError:
+                    img = blank_image(THUMB_SIZE)  # missing: rebuilt by the image check, which invalidates it
+                else:
+                    if self.atlas is not None:
+                        self.atlas.put(car["thumb"], img)
+            if decorate is not None:
+                img = decorate(img)
+            photo = ImageTk.PhotoImage(img)
+        size = photo.width() * photo.height() * 4
+        self.entries[key] = (photo, size)
+        self.keys_by_id.setdefault(car_id, set()).add(key)
+        self.bytes += size
+        self._evict()
+        return photo
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            key, (photo, size) = self.entries.popitem(last=False)
+            self._drop_key(key, size)
+
+    def _drop_key(self, key, size):
+        self.bytes -= size
+        keys = self.keys_by_id.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_id[key[0]]
+
+    def invalidate(self, car_id):
+        for key in self.keys_by_id.pop(car_id, ()):
+            photo, size = self.entries.pop(key)
+            self.bytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_id.clear()
+        self.bytes = 0
+
+
+class BrandPager:
+    # Sequence over one brand's index bucket that materializes cars a page at a time, only as far
+    # as the grid has scrolled, so opening a brand costs the same whatever its size.
+    def __init__(self, bucket, page_size=BRAND_PAGE_SIZE):
+        self.bucket = bucket
+        self.page_size = page_size
+        self.length = len(bucket)
+        self.loaded = []
+        self._cars = iter(bucket.values())
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        while index >= len(self.loaded):
+            if not self._fetch_page():
+                self.length = len(self.loaded)
+                return None
+        return self.loaded[index]
+
+    def _fetch_page(self):
+        try:
+            page = list(itertools.islice(self._cars, self.page_size))
+        except RuntimeError:
+            # The bucket changed under us; carry on from the same position in its new contents.
+            self._cars = itertools.islice(iter(self.bucket.values()), len(self.loaded), None)
+            page = list(itertools.islice(self._cars, self.page_size))
+        self.loaded.extend(page)
+        return bool(page)
+
+
+class ShardSection:
+    # Stands in for a brand whose shard has not been read: as long as the brand, so the layout is
+    # right, but without cards. The first time the grid asks for a card, i.e. once the section has
+    # scrolled into view, it asks for the shard.
+    def __init__(self, brand, count, request):
+        self.brand = brand
+        self.count = count
+        self.request = request
+        self.requested = False
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(())
+
+    def __getitem__(self, index):
+        if not self.requested:
+            self.requested = True
+            self.request(self.brand)
+        return None
+
+
+class _CardSlot:
+    __slots__ = ("label", "item", "car", "pos")
+
+    def __init__(self, label, item):
+        self.label = label
+        self.item = item
+        self.car = None
+        self.pos = None
+
+
+class _HeaderSlot:
+    __slots__ = ("label", "label_item", "sep", "sep_item", "brand")
+
+    def __init__(self, label, label_item, sep, sep_item):
+        self.label = label
+        self.label_item = label_item
+        self.sep = sep
+        self.sep_item = sep_item
+        self.brand = None
+
+
+class VirtualGrid:
+    # Lays out brand sections of cards on a canvas but only creates widgets for the
+    # rows inside the viewport (plus GRID_OVERSCAN rows), recycling them while scrolling.
+    # With on_selection_change set, ctrl-click toggles a card in `selected` (a set of car ids)
+    # and shift-click adds the run of cards from the last one toggled.
+    def __init__(self, canvas, scrollbar, image_for, on_card_click, on_header_click=None, columns=CARD_COLUMNS,
+                 on_selection_change=None):
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.image_for = image_for
+        self.on_card_click = on_card_click
+        self.on_header_click = on_header_click
+        self.on_selection_change = on_selection_change
+        self.selected = set()
+        self.anchor = None
+        self.columns = columns
+        self.sections = []
+        self.section_tops = []
+        self.height = 0
+        self.card_pool = []
+        self.header_pool = []
+        self.shown = set()
+        self.brands = set()
+        self.forgotten = False
+        self._render_job = None
+
+        canvas.configure(yscrollcommand=self._on_yview)
+        canvas.bind("<Configure>", lambda e: self.schedule_render(), add="+")
+
+    def update_sections(self, sections, relayout=False):
+        # Diff against what the grid currently holds; cards that stay keep their bound widgets.
+        # relayout is for edits that may have moved cards without changing which are shown.
+        shown = {car["id"] for brand, cars in sections for car in cars}
+        brands = {brand for brand, cars in sections}
+        hide = self.shown - shown
+        show = shown - self.shown
+        added_brands = brands - self.brands
+        removed_brands = self.brands - brands
+        if hide or show or added_brands or removed_brands or relayout or self.forgotten:
+            for slot in self.card_pool:
+                if slot.car is not None and slot.car["id"] in hide:
+                    self.release_card(slot)
+            self.shown = shown
+            self.brands = brands
+            self.set_sections(sections)
+            if not self.selected <= shown:
+                self.selected &= shown
+                self._selection_changed()
+        return hide, show, added_brands, removed_brands
+
+    def set_sections(self, sections):
+        self.anchor = None  # positions of the old layout
+        self.forgotten = False
+        self.sections = sections
+        self.section_tops = []
+        y = 0
+        for brand, cars in sections:
+            self.section_tops.append(y)
+            if brand is not None:
+                y += HEADER_HEIGHT
+            y += (len(cars) + self.columns - 1) // self.columns * CARD_HEIGHT
+        self.height = y
+        self.canvas.configure(scrollregion=(0, 0, self.columns * CARD_WIDTH, y))
+        self.render()
+
+    def _on_yview(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_render()
+
+    def schedule_render(self):
+        if self._render_job is None:
+            self._render_job = self.canvas.after_idle(self.render)
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = top + max(self.canvas.winfo_height(), CARD_HEIGHT)
+        return top - GRID_OVERSCAN * CARD_HEIGHT, bottom + GRID_OVERSCAN * CARD_HEIGHT
+
+    @profiler.timed("grid_render")
+    def render(self):
+        if self._render_job is not None:
+            self.canvas.after_cancel(self._render_job)
+            self._render_job = None
+
+        top, bottom = self.visible_range()
+        headers = []
+        cards = []
+        start = max(bisect.bisect_right(self.section_tops, top) - 1, 0)
+        for index in range(start, len(self.sections)):
+            y = self.section_tops[index]
+            if y > bottom:
+                break
+            brand, cars = self.sections[index]
+            if brand is not None:
+                if y + HEADER_HEIGHT >= top:
+                    headers.append((brand, y))
+                y += HEADER_HEIGHT
+            rows = (len(cars) + self.columns - 1) // self.columns
+            first_row = max(int((top - y) // CARD_HEIGHT), 0)
+            last_row = min(int((bottom - y) // CARD_HEIGHT), rows - 1)
+            for row in range(first_row, last_row + 1):
+                for col in range(self.columns):
+                    i = row * self.columns + col
+                    car = cars[i] if i < len(cars) else None
+                    if car is None:
+                        break
+                    cards.append((car, col * CARD_WIDTH, y + row * CARD_HEIGHT, (index, i)))
+
+        self._place_headers(headers)
+        self._place_cards(cards)
+
+    def _place_headers(self, headers):
+        while len(self.header_pool) < len(headers):
+            label = tk.Label(self.canvas, font=("Arial", 11), cursor="hand2", bg="#f0f0f0",
+                             activebackground="#cccccc")
+            sep = ttk.Separator(self.canvas, orient='horizontal')
+            slot = _HeaderSlot(label, self.canvas.create_window(0, 0, window=label, anchor="nw"),
+                               sep, self.canvas.create_window(0, 0, window=sep, anchor="nw",
+                                                              width=self.columns * CARD_WIDTH))
+            label.bind("<Button-1>", lambda e, s=slot: self.on_header_click and self.on_header_click(s.brand))
+            self.header_pool.append(slot)
+
+        for slot, (brand, y) in zip(self.header_pool, headers):
+            if slot.brand != brand:
+                slot.brand = brand
+                slot.label.configure(text=brand)
+            self.canvas.coords(slot.label_item, 0, y + 10)
+            self.canvas.coords(slot.sep_item, 0, y + HEADER_HEIGHT - 5)
+            self.canvas.itemconfigure(slot.label_item, state="normal")
+            self.canvas.itemconfigure(slot.sep_item, state="normal")
+        for slot in self.header_pool[len(headers):]:
+            slot.brand = None
+            self.canvas.itemconfigure(slot.label_item, state="hidden")
+            self.canvas.itemconfigure(slot.sep_item, state="hidden")
+
+    def _place_cards(self, cards):
+        while len(self.card_pool) < len(cards):
+            label = tk.Label(self.canvas, compound="top", cursor="hand2", bg=CARD_BG,
+                             width=CARD_WIDTH - 20, height=CARD_HEIGHT - 20, wraplength=CARD_WIDTH - 20)
+            slot = _CardSlot(label, self.canvas.create_window(0, 0, window=label, anchor="nw"))
+            label.bind("<Enter>", lambda e, s=slot: self.paint_card(s, hover=True))
+            label.bind("<Leave>", lambda e, s=slot: self.paint_card(s))
+            label.bind("<Button-1>", lambda e, s=slot: self._on_click(e, s))
+            self.card_pool.append(slot)
+
+        # Cards that stay on screen keep their slot so only newly exposed cards load images.
+        bound = {id(slot.car): slot for slot in self.card_pool if slot.car is not None}
+        wanted = {id(car) for car, x, y, pos in cards}
+        free = [slot for slot in self.card_pool if slot.car is None or id(slot.car) not in wanted]
+        for car, x, y, pos in cards:
+            slot = bound.get(id(car))
+            if slot is None:
+                slot = free.pop()
+                self.bind_card(slot, car)
+            slot.pos = pos
+            self.canvas.coords(slot.item, x + 10, y + 10)
+            self.canvas.itemconfigure(slot.item, state="normal")
+        for slot in free:
+            self.release_card(slot)
+
+    def release_card(self, slot):
+        slot.car = None
+        slot.pos = None
+        slot.label.configure(image="", text="", bg=CARD_BG)
+        slot.label.image = None
+        self.canvas.itemconfigure(slot.item, state="hidden")
+
+    def bind_card(self, slot, car):
+        slot.car = car
+        photo = self.image_for(car)
+        slot.label.configure(image=photo, text=car["model"])
+        slot.label.image = photo
+        self.paint_card(slot)
+
+    def paint_card(self, slot, hover=False):
+        if hover:
+            bg = CARD_HOVER_BG
+        elif slot.car is not None and slot.car["id"] in self.selected:
+            bg = CARD_SELECTED_BG
+        else:
+            bg = CARD_BG
+        slot.label.configure(bg=bg)
+
+    def refresh_card(self, car_id):
+        self.refresh_cards({car_id})
+
+    def refresh_cards(self, car_ids):
+        for slot in self.card_pool:
+            if slot.car is not None and slot.car["id"] in car_ids:
+                self.bind_card(slot, slot.car)
+
+    def _on_click(self, event, slot):
+        car = slot.car
+        if car is None:
+            return
+        if self.on_selection_change is None or not event.state & (SHIFT_MASK | CONTROL_MASK):
+            self.on_card_click(car)
+            return
+        if event.state & SHIFT_MASK and self.anchor is not None:
+            self.select_range(self.anchor, slot.pos)
+        else:
+            self.selected ^= {car["id"]}
+        self.anchor = slot.pos
+        self._selection_changed()
+
+    def select_range(self, start, end):
+        (first_section, first), (last_section, last) = sorted((start, end))
+        for index in range(first_section, last_section + 1):
+            cars = self.sections[index][1]
+            stop = last if index == last_section else len(cars) - 1
+            for i in range(first if index == first_section else 0, stop + 1):
+                car = cars[i]
+                if car is None:
+                    break
+                self.selected.add(car["id"])
+
+    def clear_selection(self):
+        if self.selected:
+            self.selected = set()
+            self.anchor = None
+            self._selection_changed()
+
+    def _selection_changed(self):
+        for slot in self.card_pool:
+            if slot.car is not None:
+                self.paint_card(slot)
+        if self.on_selection_change is not None:
+            self.on_selection_change(self.selected)
+
+    def forget(self):
+        # The next update_sections lays out from scratch, even if it shows nothing.
+        for slot in self.card_pool:
+            self.release_card(slot)
+        self.shown = set()
+        self.brands = set()
+        self.forgotten = True
+
+
+def count_widgets(widget):
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
 
 
 class HotWheelsApp:
-    def __init__(self, root):
+    def __init__(self, root, profile=False):
         self.root = root
         self.root.title("Hot Wheels Catalog")
         self.root.minsize(800, 600)
 
-        self.catalog = load_catalog()
-        self.filtered_catalog = self.catalog.copy()
-        self.brand_list = load_brands()
+        # Only enough records for the first screen are read here; the rest stream in on a worker.
+        self.catalog = Catalog(stream=True)
+        self.catalog.add_loaded(*self.catalog.read_batch(LOAD_FIRST_BATCH))
+        self.catalog.on_dirty = self.schedule_flush
+        self._flush_job = None
+        self.filtered_catalog = []
+        self._load_refresh_job = None
+        self._load_slices = deque()
+        self._index_job = None
+        self._search_job = None
+        self._applied_view = None
+        self.thumb_atlas = ThumbnailAtlas()
+        self.thumb_cache = ThumbnailCache(self.thumb_atlas)
+        self.jobs = BackgroundJobs(root, on_change=self.show_pending_jobs)
+        self.pending_thumbs = set()
+        self.stats_tab = None
+        self.profile_tab = None
+        self.profile = profile
+        self.placeholder_photo = None
+        self.importing = False
+        self.import_unsaved = False
+        self.scanning = False
+        self.hashing = False
+        self.loading_shards = set()
+        self.image_status = ""
+        self.detail_tabs = {}
 
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(fill='both', expand=True)
@@ -72,10 +576,227 @@ class HotWheelsApp:
         self.car_image_path = None
 
         self.init_catalog_tab()
+        if self.catalog.loading:
+            self.jobs.submit(self.stream_catalog, on_error=self.catalog_load_failed)
+        else:
+            self.root.after_idle(self.start_image_scan)
+        self.root.after_idle(self.resume_bulk_import)
+        self.root.protocol("WM_DELETE_WINDOW", self.close_app)
+        self.root.bind_all("<Control-z>", lambda event: self.undo())
+        self.root.bind_all("<Control-y>", lambda event: self.redo())
+        self.root.bind_all("<Control-Z>", lambda event: self.redo())
+        self.root.bind_all("<F12>", lambda event: self.open_profile_tab())
+        if profile:
+            self.open_profile_tab()
 
         # Define open_add_tab function
         self.brand_dropdown = None
 
+    def stream_catalog(self):
+        # Runs on a worker thread; every parsed batch is indexed on the Tk thread.
+        done = False
+        while not done:
+            batch, done = self.catalog.read_batch(LOAD_BATCH_SIZE)
+            self.jobs.post(self.catalog_batch_loaded, batch, done)
+
+    def catalog_batch_loaded(self, batch, done):
+        # Indexed in slices of LOAD_SLICE_SIZE, LOAD_SLICE_MS worth per tick, so input and
+        # scrolling are handled between them however large the catalog is.
+        for i in range(0, len(batch), LOAD_SLICE_SIZE):
+            self._load_slices.append((batch[i:i + LOAD_SLICE_SIZE], done and i + LOAD_SLICE_SIZE >= len(batch)))
+        if done and not batch:
+            self._load_slices.append(([], True))
+        if self._index_job is None:
+            self._index_job = self.root.after(1, self.index_loaded_slices)
+
+    def index_loaded_slices(self):
+        self._index_job = None
+        deadline = time.perf_counter() + LOAD_SLICE_MS / 1000
+        done = False
+        while self._load_slices and not done and time.perf_counter() < deadline:
+            batch, done = self._load_slices.popleft()
+            self.catalog.add_loaded(batch, done)
+        self.show_pending_jobs(self.jobs.pending)
+        if self._load_slices:
+            self._index_job = self.root.after(1, self.index_loaded_slices)
+        if done:
+            self.clear_saved_import()
+            self.root.after_idle(self.start_image_scan)
+            if self._load_refresh_job is not None:
+                self.root.after_cancel(self._load_refresh_job)
+            self._load_refresh_job = self.root.after_idle(self.show_loaded_cars)
+        elif self._load_refresh_job is None:
+            # Re-filtering the whole view per slice would cost more than the slices themselves.
+            self._load_refresh_job = self.root.after(LOAD_REFRESH_MS, self.show_loaded_cars)
+
+    @profiler.timed("show_loaded_cars")
+    def show_loaded_cars(self):
+        self._load_refresh_job = None
+        self.filter_catalog()
+        self.catalog_grid.update_sections(self.brand_sections())
+        self.refresh_stats()
+
+    def schedule_flush(self):
+        # Edits are written once they have stopped coming for PERSIST_IDLE_MS.
+        if self._flush_job is not None:
+            self.root.after_cancel(self._flush_job)
+        self._flush_job = self.root.after(PERSIST_IDLE_MS, self.flush_catalog)
+
+    def flush_catalog(self):
+        self._flush_job = None
+        try:
+            self.catalog.flush()
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Could not save the catalog: {e}")
+        self.clear_saved_import()
+
+    def clear_saved_import(self):
+        # An import that finished while the catalog was still loading is only written by a later
+        # flush; its progress file has to stay until then, or nothing would resume the import.
+        if self.import_unsaved and not self.catalog.dirty:
+            self.import_unsaved = False
+            clear_import_progress()
+
+    def close_app(self):
+        if self._flush_job is not None:
+            self.root.after_cancel(self._flush_job)
+        try:
+            self.catalog.close()
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Could not save the catalog: {e}")
+        if self.profile:
+            # Started in __main__ for --profile, so the capture covers startup as well.
+            try:
+                profiler.stop_capture()
+                profiler.export(extra={"gauges": self.profile_gauges()})
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not write the profile: {e}")
+        self.thumb_atlas.close()
+        self.root.destroy()
+
+    def undo(self):
+        self.apply_history(self.catalog.undo)
+
+    def redo(self):
+        self.apply_history(self.catalog.redo)
+
+    def apply_history(self, step):
+        try:
+            command = step()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if command is None:
+            return
+        for car in command.cars:
+            self.thumb_cache.invalidate(car["id"])
+        self.close_detail_tabs(command.cars)
+        if self.brand_dropdown is not None:
+            self.brand_dropdown['values'] = self.catalog.brands.names()
+        self.refresh_catalog()
+
+    def close_detail_tabs(self, cars):
+        # Their entries would show stale values, or a car that is gone.
+        for car in cars:
+            tab = self.detail_tabs.get(car["id"])
+            if tab is not None:
+                self.close_tab(tab)
+
+    def selection_changed(self, selected):
+        state = "normal" if selected else "disabled"
+        self.selection_label.configure(text=f"{len(selected)} selected" if selected else "Ctrl/Shift-click to select")
+        self.batch_button.configure(state=state)
+        self.clear_selection_button.configure(state=state)
+
+    def open_batch_editor(self):
+        cars = [car for car in map(self.catalog.get, self.catalog_grid.selected) if car is not None]
+        if not cars:
+            return
+        window = tk.Toplevel(self.root)
+        window.title(f"Edit {len(cars)} Car(s)")
+        window.transient(self.root)
+        window.grab_set()
+
+        rows = []
+        for row, (field, label, operations) in enumerate(BATCH_FIELDS):
+            tk.Label(window, text=f"{label}:", anchor="w").grid(row=row, column=0, sticky="w", padx=5, pady=2)
+            labels = ["Keep"] + [BATCH_OPERATION_LABELS[operation] for operation in operations]
+            mode = tk.StringVar(value="Keep")
+            ttk.Combobox(window, textvariable=mode, values=labels, state="readonly", width=12).grid(
+                row=row, column=1, padx=5)
+            value = tk.StringVar()
+            if field == "brand":
+                value.set(cars[0]["brand"])
+                widget = ttk.Combobox(window, textvariable=value, values=self.catalog.brands.names(), state="readonly")
+            elif field == "open_state":
+                value.set("Cased")
+                widget = ttk.Combobox(window, textvariable=value, values=("Cased", "Open"), state="readonly")
+            else:
+                widget = tk.Entry(window, textvariable=value)
+            widget.grid(row=row, column=2, sticky="we", padx=5)
+            rows.append((field, dict(zip(labels[1:], operations)), mode, value))
+
+        def apply_batch():
+            updates = {}
+            for field, operations, mode, value in rows:
+                operation = operations.get(mode.get())
+                if operation is not None:
+                    updates[field] = (operation, value.get())
+            if not updates:
+                window.destroy()
+                return
+            try:
+                amounts = parse_car_fields({field: amount for field, (operation, amount) in updates.items()})
+                self.catalog.edit_cars(cars, {field: (updates[field][0], amounts[field]) for field in updates})
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=window)
+                return
+            window.destroy()
+            self.close_detail_tabs(cars)
+            self.refresh_cars({car["id"] for car in cars})
+
+        tk.Button(window, text="Apply", command=apply_batch, cursor="hand2").grid(
+            row=len(BATCH_FIELDS), column=0, columnspan=3, pady=10)
+
+    def update_history_buttons(self):
+        history = self.catalog.history
+        for button, stack, verb in ((self.undo_button, history.undo_stack, "Undo"),
+                                    (self.redo_button, history.redo_stack, "Redo")):
+            if stack:
+                button.configure(text=f"{verb} {stack[-1].label.lower()}", state="normal")
+            else:
+                button.configure(text=verb, state="disabled")
+
+    def catalog_load_failed(self, error):
+        messagebox.showerror("Error", f"Could not load the catalog: {error}")
+
+    def request_shard(self, brand):
+        # With a sharded store a brand's cars are read on a worker the first time they are needed.
+        if brand in self.loading_shards or brand not in self.catalog.unloaded:
+            return
+        self.loading_shards.add(brand)
+        self.jobs.submit(self.catalog.read_shard, brand, on_done=lambda cars: self.shard_loaded(brand, cars),
+                         on_error=lambda error: self.shard_load_failed(brand, error))
+
+    def load_all_brands(self):
+        # Searching, filtering, sorting and the totals need every brand.
+        for brand in list(self.catalog.unloaded):
+            self.request_shard(brand)
+
+    def shard_loaded(self, brand, cars):
+        self.loading_shards.discard(brand)
+        self.catalog.add_shard(brand, cars)
+        self.show_pending_jobs(self.jobs.pending)
+        if self._load_refresh_job is None:
+            self._load_refresh_job = self.root.after_idle(self.show_loaded_cars)
+        if self.catalog.complete:
+            self.clear_saved_import()
+            self.root.after_idle(self.start_image_scan)
+
+    def shard_load_failed(self, brand, error):
+        self.loading_shards.discard(brand)
+        self.catalog_load_failed(error)
+
     def open_add_tab(self):
         for tab_id in self.notebook.tabs():
             if self.notebook.tab(tab_id, "text") == "Add Car":
@@ -99,10 +820,10 @@ class HotWheelsApp:
             tk.Label(frame, text=label).grid(row=i, column=0, sticky='e')
             if label == "Brand":
                 self.brand_var = tk.StringVar()
-                self.brand_dropdown = ttk.Combobox(frame, textvariable=self.brand_var, values=self.brand_list,
-                                                   state="readonly", width=37)
+                self.brand_dropdown = ttk.Combobox(frame, textvariable=self.brand_var,
+                                                   values=self.catalog.brands.names(), state="readonly", width=37)
                 self.brand_dropdown.grid(row=i, column=1, sticky='w')
-                self.brand_dropdown.set(self.brand_list[0])
+                self.brand_dropdown.set(self.catalog.brands.first())
                 add_button = tk.Button(frame, text="+", width=3, command=self.add_custom_brand, cursor="hand2")
                 add_button.grid(row=i, column=2, sticky='w', padx=5)
             else:
@@ -164,18 +885,14 @@ class HotWheelsApp:
         tk.Button(brand_prompt, text="Upload Image", command=upload_brand_image).pack(pady=5)
 
         def submit_brand():
-            new_brand = brand_entry.get().strip()
-            if new_brand and new_brand not in self.brand_list:
-                self.brand_list.append(new_brand)
-                save_brands(self.brand_list)
-                self.brand_dropdown['values'] = self.brand_list
-                self.brand_dropdown.set(new_brand)
-                if self.brand_image_path:
-                    ext = os.path.splitext(self.brand_image_path)[1]
-                    brand_img_filename = f"{new_brand.replace(' ', '_')}_logo{ext}"
-                    dest_path = os.path.join(IMAGE_DIR, brand_img_filename)
-                    shutil.copy(self.brand_image_path, dest_path)
-                brand_prompt.destroy()
+            try:
+                new_brand = self.catalog.add_brand(brand_entry.get(), self.brand_image_path)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=brand_prompt)
+                return
+            self.brand_dropdown['values'] = self.catalog.brands.names()
+            self.brand_dropdown.set(new_brand)
+            brand_prompt.destroy()
 
         tk.Button(brand_prompt, text="Add Brand", command=submit_brand).pack(pady=5)
 
@@ -189,55 +906,32 @@ class HotWheelsApp:
         for entry in self.entries.values():
             entry.delete(0, tk.END)
         self.cased_var.set(True)
-        self.brand_dropdown.set(self.brand_list[0])
+        self.brand_dropdown.set(self.catalog.brands.first())
         self.car_image_path = None
 
     def add_car(self):
-        data = {}
         brand = self.brand_var.get().strip()
         if not brand:
             messagebox.showerror("Error", "Brand is required.")
             return
-        data["brand"] = brand
-
+        values = {"brand": brand}
         for key, entry in self.entries.items():
-            value = entry.get().strip()
-            if key in ['bought_value', 'internet_value', 'year']:
-                if not value:
-                    value = 0
-                try:
-                    value = float(value)
-                except ValueError:
-                    messagebox.showerror("Error", f"{key.replace('_', ' ').title()} must be a number.")
-                    return
-            data[key] = value
-
-        data["open_state"] = "Cased" if self.cased_var.get() else "Open"
-
-        if not self.car_image_path:
-            placeholder_path = os.path.join(IMAGE_DIR, "placeholder.png")
-            if not os.path.exists(placeholder_path):
-                img = Image.new('RGB', (300, 300), color=(200, 200, 200))
-                img.save(placeholder_path)
-            self.car_image_path = placeholder_path
-
-        car_id = str(uuid.uuid4())
-        ext = os.path.splitext(self.car_image_path)[1]
-        image_filename = f"{car_id}{ext}"
-        thumb_filename = f"{car_id}_thumb{ext}"
-        image_dest = os.path.join(IMAGE_DIR, image_filename)
-        thumb_dest = os.path.join(THUMB_DIR, thumb_filename)
-
-        shutil.copy(self.car_image_path, image_dest)
-        create_thumbnail(image_dest, thumb_dest)
-
-        data["image"] = image_filename
-        data["thumb"] = thumb_filename
-        data["id"] = car_id
-
-        self.catalog.append(data)
-        self.filtered_catalog = self.catalog.copy()
-        save_catalog(self.catalog)
+            values[key] = entry.get()
+        values["open_state"] = "Cased" if self.cased_var.get() else "Open"
+        try:
+            data = parse_car_fields(values)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        # The card shows a placeholder until the worker has copied the image and built its thumbnail;
+        # the record is only written to disk once that succeeded.
+        car, source = self.catalog.new_car(data, self.car_image_path)
+        self.pending_thumbs.add(car["id"])
+        self.catalog.hold_images()
+        self.jobs.submit(ingest_image, source, self.thumb_atlas,
+                         on_done=lambda names: self.car_image_ready(car, names),
+                         on_error=lambda error: self.car_image_failed(car, error))
         self.refresh_catalog()
 
         # Add '+' button fixed to bottom right of the visible catalog_tab
@@ -245,6 +939,261 @@ class HotWheelsApp:
         messagebox.showinfo("Success", "Car added to catalog.")
         self.clear_form()
 
+    def car_image_ready(self, car, names):
+        self.pending_thumbs.discard(car["id"])
+        self.thumb_cache.invalidate(car["id"])
+        self.catalog.confirm_car(car, *names)
+        self.catalog.release_images()
+        self.catalog_grid.refresh_card(car["id"])
+        self.update_history_buttons()
+        self.warn_similar(car)
+
+    def warn_similar(self, car):
+        similar = self.catalog.similar_cars(car)
+        if not similar:
+            return
+        lines = [f"{other['brand']} {other['model']}" for other in similar[:5]]
+        if len(similar) > 5:
+            lines.append(f"... {len(similar)} car(s) in total")
+        messagebox.showwarning("Possible Duplicate",
+                               f"The image of {car['model']} looks like the one of:\n\n" + "\n".join(lines))
+
+    def car_image_failed(self, car, error):
+        self.pending_thumbs.discard(car["id"])
+        self.catalog.discard_car(car)
+        self.catalog.release_images()
+        self.refresh_catalog()
+        messagebox.showerror("Error", f"Could not add image for {car['model']}: {error}")
+
+    def open_import_dialog(self):
+        import_window = tk.Toplevel(self.root)
+        import_window.update_idletasks()
+        w = 300
+        h = 140
+        x = (import_window.winfo_screenwidth() // 2) - (w // 2)
+        y = (import_window.winfo_screenheight() // 2) - (h // 2)
+        import_window.geometry(f"{w}x{h}+{x}+{y}")
+        import_window.title("Bulk Import")
+        import_window.transient(self.root)
+        import_window.grab_set()
+
+        def choose_folder():
+            path = filedialog.askdirectory(parent=import_window)
+            import_window.destroy()
+            if path:
+                self.start_bulk_import(path)
+
+        def choose_manifest():
+            path = filedialog.askopenfilename(parent=import_window,
+                                              filetypes=[("Manifest Files", "*.csv *.json")])
+            import_window.destroy()
+            if path:
+                self.start_bulk_import(path)
+
+        tk.Button(import_window, text="Import Folder", width=15, command=choose_folder).pack(pady=10)
+        tk.Button(import_window, text="Import CSV/JSON", width=15, command=choose_manifest).pack(pady=10)
+
+    def resume_bulk_import(self):
+        header, done = load_import_progress()
+        if header is None:
+            return
+        if os.path.exists(header["source"]) and messagebox.askyesno(
+                "Resume Import",
+                f"An import of {header['source']} was interrupted after {len(done)} car(s). Resume it?"):
+            self.start_bulk_import(header["source"], header.get("brand"))
+        else:
+            clear_import_progress()
+
+    def start_bulk_import(self, source, default_brand=None):
+        if self.importing:
+            messagebox.showinfo("Busy", "An import is already running.")
+            return
+        self.importing = True
+        default_brand = default_brand or self.catalog.brands.first()
+
+        def report(done, total, rate):
+            self.jobs.post(self.jobs_label.configure, {"text": f"Importing {done}/{total} ({rate:.1f} images/sec)"})
+
+        self.catalog.hold_images()
+        self.jobs.submit(bulk_import, source, default_brand, report,
+                         on_done=self.finish_bulk_import, on_error=self.bulk_import_failed)
+
+    def finish_bulk_import(self, result):
+        records, failures, rate = result
+        self.importing = False
+        self.import_unsaved = True
+        self.catalog.add_records(records)
+        self.catalog.release_images()
+        if self.brand_dropdown is not None:
+            self.brand_dropdown['values'] = self.catalog.brands.names()
+        # Written now rather than on the coalesced flush: the progress file is what resumes the
+        # import if it is lost, so it only goes once the cars are in the store.
+        try:
+            self.catalog.flush()
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Could not save the import: {e}")
+        self.clear_saved_import()
+        self.refresh_catalog()
+        message = f"Imported {len(records)} car(s) at {rate:.1f} images/sec."
+        if failures:
+            message += f"\n{len(failures)} failed:\n" + "\n".join(failures[:10])
+        messagebox.showinfo("Import Complete", message)
+
+    def bulk_import_failed(self, error):
+        self.importing = False
+        self.catalog.release_images()
+        self.show_pending_jobs(self.jobs.pending)
+        messagebox.showerror("Error", f"Import failed: {error}")
+
+    def start_image_scan(self, interactive=False):
+        # Cross-checks the stored images on a worker; only files changed since the last scan are
+        # verified, and missing thumbnails are rebuilt. Cars show a blank card until then.
+        if self.scanning or not self.catalog.complete:
+            if interactive:
+                self.load_all_brands()
+                messagebox.showinfo("Busy", "The catalog is still loading or being checked; try again in a moment.")
+            return
+        self.scanning = True
+
+        def report(done, total):
+            self.jobs.post(self.jobs_label.configure, {"text": f"Checking images {done}/{total}"})
+
+        self.jobs.submit(scan_images, list(self.catalog.images.refs), report,
+                         on_done=lambda result: self.image_scan_finished(result, interactive),
+                         on_error=lambda error: self.image_scan_failed(error, interactive))
+
+    def image_scan_finished(self, result, interactive):
+        self.scanning = False
+        self.start_hash_backfill()
+        repaired = set(result["repaired"])
+        for name in repaired:
+            self.thumb_atlas.discard(thumb_name(name))
+        if repaired:
+            for car in self.catalog.cars:
+                if car.get("image") in repaired:
+                    self.thumb_cache.invalidate(car["id"])
+                    self.catalog_grid.refresh_card(car["id"])
+        # The scan only runs on a complete catalog, so tiles of thumbnails nothing uses can go.
+        self.thumb_atlas.retain({car.get("thumb") for car in self.catalog.cars})
+        problems = len(result["missing"]) + len(result["damaged"])
+        orphans = result["orphans"]
+        self.image_status = ""
+        if problems or orphans:
+            self.image_status = f"{problems} image problem(s), {len(orphans)} orphaned file(s)"
+        if not interactive:
+            return
+
+        lines = [f"Checked {result['checked']} changed image(s); rebuilt {len(repaired)} thumbnail(s)."]
+        lines += [f"Missing: {name}" for name in result["missing"][:10]]
+        lines += [f"Damaged: {error}" for error in result["damaged"][:10]]
+        if len(lines) - 1 < problems:
+            lines.append(f"... {problems} problem(s) in total")
+        message = "\n".join(lines)
+        if not orphans:
+            messagebox.showinfo("Image Check", message)
+            return
+        size = result["orphan_bytes"] / (1024 * 1024)
+        if messagebox.askyesno("Image Check", f"{message}\n\nRemove {len(orphans)} orphaned file(s) ({size:.1f} MB)?"):
+            try:
+                removed = self.catalog.remove_orphans(orphans)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.image_status = f"{problems} image problem(s)" if problems else ""
+            self.show_pending_jobs(self.jobs.pending)
+            messagebox.showinfo("Image Check", f"Removed {len(removed)} orphaned file(s).")
+
+    def image_scan_failed(self, error, interactive):
+        self.scanning = False
+        self.start_hash_backfill()
+        if interactive:
+            messagebox.showerror("Error", f"Image check failed: {error}")
+
+    def start_hash_backfill(self):
+        # Images stored before perceptual hashes were taken at ingest are hashed once, after the
+        # image check so the two pools do not compete.
+        names = self.catalog.unhashed_images()
+        if self.hashing or not names:
+            return
+        self.hashing = True
+
+        def report(done, total):
+            self.jobs.post(self.jobs_label.configure, {"text": f"Indexing images {done}/{total}"})
+
+        self.jobs.submit(backfill_hashes, names, report, on_done=self.hash_backfill_finished,
+                         on_error=self.hash_backfill_failed)
+
+    def hash_backfill_finished(self, result):
+        self.hashing = False
+        self.catalog.set_hashes(result[0])
+
+    def hash_backfill_failed(self, error):
+        self.hashing = False
+
+    def export_view(self):
+        # Exports the cars the catalog tab shows, so the search box and filters choose what is written.
+        if not self.catalog.complete:
+            self.load_all_brands()
+            messagebox.showinfo("Busy", "The catalog is still loading; try again in a moment.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".html", initialfile="catalog.html",
+                                            filetypes=[("HTML gallery", "*.html"), ("CSV", "*.csv"),
+                                                       ("JSON Lines", "*.jsonl"), ("JSON", "*.json")])
+        if not path:
+            return
+
+        def report(done, total):
+            self.jobs.post(self.jobs_label.configure, {"text": f"Exporting {done}/{total}"})
+
+        self.jobs.submit(export_cars, list(self.filtered_catalog), path, None, report,
+                         on_done=lambda count: messagebox.showinfo("Export", f"Exported {count} car(s) to {path}."),
+                         on_error=lambda error: messagebox.showerror("Error", f"Could not export the cars: {error}"))
+
+    def find_duplicates(self):
+        if self.hashing or not self.catalog.complete:
+            self.load_all_brands()
+            messagebox.showinfo("Busy", "The catalog is still loading or being indexed; try again in a moment.")
+            return
+        groups = self.catalog.find_duplicates()
+        if not groups:
+            messagebox.showinfo("Find Duplicates", "No cars with near-identical images were found.")
+            return
+        for tab_id in self.notebook.tabs():
+            if self.notebook.tab(tab_id, "text") == "Duplicates":
+                tab = self.root.nametowidget(tab_id)
+                self.close_tab(tab)
+                tab.destroy()
+
+        tab = ttk.Frame(self.notebook)
+        self.notebook.add(tab, text="Duplicates")
+        self.notebook.select(tab)
+        tk.Button(tab, text="Close Tab", command=lambda: [self.close_tab(tab), tab.destroy()]).pack(
+            anchor='ne', padx=5, pady=5)
+        tk.Label(tab, text=f"{len(groups)} group(s) of likely duplicates", font=("Arial", 14, "bold"),
+                 anchor="center").pack(pady=(0, 5))
+        ttk.Separator(tab, orient='horizontal').pack(fill='x', padx=10, pady=(0, 10))
+
+        canvas = tk.Canvas(tab)
+        scrollbar = ttk.Scrollbar(tab, orient="vertical", command=canvas.yview)
+        grid = VirtualGrid(canvas, scrollbar, lambda car: self.card_image(car, badge=False), self.open_detail_tab)
+        canvas.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        grid.set_sections([(f"Group {i}: {len(cars)} cars", cars) for i, cars in enumerate(groups, 1)])
+
+    def show_pending_jobs(self, pending):
+        # Image checks, hash backfills and shard reads count as pending jobs but are reported on their own.
+        background = self.scanning + self.hashing + len(self.loading_shards)
+        if self.catalog.loading:
+            self.jobs_label.configure(text=f"Loading catalog ({len(self.catalog.cars)} cars so far)...")
+        elif pending > background:
+            self.jobs_label.configure(text=f"Processing {pending - background} image(s)...")
+        elif self.loading_shards:
+            self.jobs_label.configure(text=f"Loading {len(self.loading_shards)} brand(s)...")
+        elif self.scanning:
+            self.jobs_label.configure(text="Checking images...")
+        else:
+            self.jobs_label.configure(text="Indexing images..." if self.hashing else self.image_status)
+
     def edit_brand(self):
         edit_window = tk.Toplevel(self.root)
         edit_window.title("Edit Brand")
@@ -261,9 +1210,10 @@ class HotWheelsApp:
 
         tk.Label(edit_window, text="Select existing brand:").pack(pady=5)
         old_var = tk.StringVar()
-        old_entry = ttk.Combobox(edit_window, textvariable=old_var, values=self.brand_list, state="readonly")
+        old_entry = ttk.Combobox(edit_window, textvariable=old_var, values=self.catalog.brands.names(),
+                                 state="readonly")
         old_entry.pack(pady=5)
-        old_entry.set(self.brand_list[0])
+        old_entry.set(self.catalog.brands.first())
 
         tk.Label(edit_window, text="Enter new brand name:").pack(pady=5)
         new_entry = tk.Entry(edit_window)
@@ -281,41 +1231,19 @@ class HotWheelsApp:
 
         def apply_edit():
             old_brand = old_var.get().strip()
-            new_brand = new_entry.get().strip() or old_brand
-            if old_brand not in self.brand_list:
-                messagebox.showerror("Error", f"'{old_brand}' is not in the brand list.", parent=edit_window)
+            try:
+                new_brand = self.catalog.rename_brand(old_brand, new_entry.get())
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=edit_window)
                 return
-            if not new_brand:
-                messagebox.showerror("Error", "New brand name cannot be empty.", parent=edit_window)
-                return
-            if new_brand != old_brand and new_brand in self.brand_list:
-                messagebox.showerror("Error", f"'{new_brand}' already exists.", parent=edit_window)
-                return
-
-            for car in self.catalog:
-                if car["brand"] == old_brand:
-                    car["brand"] = new_brand
-
-            self.brand_list.remove(old_brand)
-            self.brand_list.append(new_brand)
-            save_brands(self.brand_list)
-            save_catalog(self.catalog)
-            self.brand_dropdown['values'] = self.brand_list
-            self.brand_dropdown.set(new_brand)
 
+            if new_brand != old_brand:
+                self.refresh_catalog()
+            if self.brand_dropdown is not None:
+                self.brand_dropdown['values'] = self.catalog.brands.names()
+                self.brand_dropdown.set(new_brand)
             if image_path.get():
-                ext = os.path.splitext(image_path.get())[1]
-                brand_img_filename = f"{new_brand.replace(' ', '_')}_logo{ext}"
-                dest_path = os.path.join(IMAGE_DIR, brand_img_filename)
-                shutil.copy(image_path.get(), dest_path)
-            else:
-                # If the brand was renamed but no new image uploaded, rename old image if it exists
-                for ext in ['.png', '.jpg', '.jpeg', '.webp', '.gif']:
-                    old_path = os.path.join(IMAGE_DIR, f"{old_brand.replace(' ', '_')}_logo{ext}")
-                    if os.path.exists(old_path):
-                        new_path = os.path.join(IMAGE_DIR, f"{new_brand.replace(' ', '_')}_logo{ext}")
-                        shutil.move(old_path, new_path)
-                        break
+                self.catalog.set_brand_logo(new_brand, image_path.get())
 
             messagebox.showinfo("Success", f"'{old_brand}' updated to '{new_brand}'.", parent=edit_window)
             edit_window.destroy()
@@ -339,24 +1267,22 @@ class HotWheelsApp:
 
         tk.Label(delete_window, text="Select the brand to delete:").pack(pady=5)
         brand_var = tk.StringVar()
-        entry = ttk.Combobox(delete_window, textvariable=brand_var, values=self.brand_list, state="readonly")
+        entry = ttk.Combobox(delete_window, textvariable=brand_var, values=self.catalog.brands.names(),
+                             state="readonly")
         entry.pack(pady=5)
-        entry.set(self.brand_list[0])
+        entry.set(self.catalog.brands.first())
 
         def confirm_delete():
             brand_to_delete = brand_var.get().strip()
             if not brand_to_delete:
                 return
-            if brand_to_delete not in self.brand_list:
-                messagebox.showerror("Error", f"'{brand_to_delete}' is not in the brand list.")
+            try:
+                self.catalog.delete_brand(brand_to_delete)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
                 return
-            if any(car['brand'] == brand_to_delete for car in self.catalog):
-                messagebox.showerror("Error", f"Cannot delete '{brand_to_delete}' — it's in use by existing cars.")
-                return
-            self.brand_list.remove(brand_to_delete)
-            save_brands(self.brand_list)
-            self.brand_dropdown['values'] = self.brand_list
-            self.brand_dropdown.set(self.brand_list[0])
+            self.brand_dropdown['values'] = self.catalog.brands.names()
+            self.brand_dropdown.set(self.catalog.brands.first())
             delete_window.lift()
             delete_window.attributes('-topmost', True)
             messagebox.showinfo("Deleted", f"'{brand_to_delete}' was removed from the brand list.",
@@ -365,27 +1291,6 @@ class HotWheelsApp:
             delete_window.destroy()
 
         tk.Button(delete_window, text="Delete", command=confirm_delete).pack(pady=10)
-        return
-        brand_to_delete = simpledialog.askstring("Delete Brand", "Enter the brand name to delete:")
-        if not brand_to_delete:
-            return
-        if brand_to_delete not in self.brand_list:
-            messagebox.showerror("Error", f"'{brand_to_delete}' is not in the brand list.")
-            return
-        if any(car['brand'] == brand_to_delete for car in self.catalog):
-            messagebox.showerror("Error", f"Cannot delete '{brand_to_delete}' — it's in use by existing cars.")
-            return
-        self.brand_list.remove(brand_to_delete)
-        save_brands(self.brand_list)
-        self.brand_dropdown['values'] = self.brand_list
-        self.brand_dropdown.set(self.brand_list[0])
-        messagebox.showinfo("Deleted", f"'{brand_to_delete}' was removed from the brand list.")
-
-        for entry in self.entries.values():
-            entry.delete(0, tk.END)
-        self.cased_var.set(False)
-        self.brand_dropdown.set(self.brand_list[0])
-        self.car_image_path = None
 
     def init_catalog_tab(self):
         search_frame = ttk.Frame(self.catalog_tab)
@@ -394,21 +1299,68 @@ class HotWheelsApp:
         self.search_var = tk.StringVar()
         search_entry = tk.Entry(search_frame, textvariable=self.search_var)
         search_entry.pack(side="left", fill="x", expand=True)
-        search_entry.bind("<KeyRelease>", lambda event: self.apply_search())
+        tk.Button(search_frame, text="Export...", command=self.export_view, cursor="hand2").pack(
+            side="right", padx=5)
+        tk.Button(search_frame, text="Import...", command=self.open_import_dialog, cursor="hand2").pack(
+            side="right", padx=5)
+        tk.Button(search_frame, text="Statistics", command=self.open_stats_tab, cursor="hand2").pack(
+            side="right", padx=5)
+        tk.Button(search_frame, text="Check Images", command=lambda: self.start_image_scan(interactive=True),
+                  cursor="hand2").pack(side="right", padx=5)
+        tk.Button(search_frame, text="Find Duplicates", command=self.find_duplicates, cursor="hand2").pack(
+            side="right", padx=5)
+        self.redo_button = tk.Button(search_frame, text="Redo", command=self.redo, cursor="hand2")
+        self.redo_button.pack(side="right", padx=5)
+        self.undo_button = tk.Button(search_frame, text="Undo", command=self.undo, cursor="hand2")
+        self.undo_button.pack(side="right", padx=5)
+        self.jobs_label = tk.Label(search_frame, text="", fg="#555555")
+        self.jobs_label.pack(side="right", padx=5)
+        search_entry.bind("<KeyRelease>", lambda event: self.schedule_search())
+
+        filter_frame = ttk.Frame(self.catalog_tab)
+        filter_frame.pack(fill="x", pady=(2, 0))
+        self.range_vars = {}
+        for field, label in RANGE_FILTERS:
+            tk.Label(filter_frame, text=f"{label}:").pack(side="left", padx=(5, 2))
+            bounds = (tk.StringVar(), tk.StringVar())
+            for i, var in enumerate(bounds):
+                if i:
+                    tk.Label(filter_frame, text="to").pack(side="left")
+                entry = tk.Entry(filter_frame, textvariable=var, width=7)
+                entry.pack(side="left", padx=2)
+                entry.bind("<KeyRelease>", lambda event: self.schedule_search())
+            self.range_vars[field] = bounds
+        self.only_opened_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(filter_frame, text="Only opened", variable=self.only_opened_var,
+                       command=self.apply_search).pack(side="left", padx=5)
+        tk.Label(filter_frame, text="Sort:").pack(side="left", padx=(10, 2))
+        self.sort_var = tk.StringVar(value="Brand")
+        sort_box = ttk.Combobox(filter_frame, textvariable=self.sort_var, values=list(SORT_OPTIONS),
+                                state="readonly", width=14)
+        sort_box.pack(side="left")
+        sort_box.bind("<<ComboboxSelected>>", lambda event: self.apply_search())
+        self.sort_desc_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(filter_frame, text="Descending", variable=self.sort_desc_var,
+                       command=self.apply_search).pack(side="left", padx=5)
+        self.clear_selection_button = tk.Button(filter_frame, text="Clear Selection", state="disabled",
+                                                command=lambda: self.catalog_grid.clear_selection(), cursor="hand2")
+        self.clear_selection_button.pack(side="right", padx=5)
+        self.batch_button = tk.Button(filter_frame, text="Edit Selected...", state="disabled",
+                                      command=self.open_batch_editor, cursor="hand2")
+        self.batch_button.pack(side="right", padx=5)
+        self.selection_label = tk.Label(filter_frame, text="Ctrl/Shift-click to select", fg="#555555")
+        self.selection_label.pack(side="right", padx=5)
 
         self.catalog_canvas = tk.Canvas(self.catalog_tab)
-        self.catalog_frame = ttk.Frame(self.catalog_canvas)
         self.scrollbar = ttk.Scrollbar(self.catalog_tab, orient="vertical", command=self.catalog_canvas.yview)
-        self.catalog_canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.catalog_grid = VirtualGrid(self.catalog_canvas, self.scrollbar, self.card_image, self.open_detail_tab,
+                                        self.open_brand_tab, on_selection_change=self.selection_changed)
 
         self.catalog_canvas.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(side="right", fill="y")
-        self.catalog_canvas.create_window((0, 0), window=self.catalog_frame, anchor="nw")
         self.catalog_canvas.bind_all("<MouseWheel>",
                                      lambda event: self.catalog_canvas.yview_scroll(int(-1 * (event.delta / 120)),
                                                                                     "units"))
-        self.catalog_frame.bind("<Configure>",
-                                lambda e: self.catalog_canvas.configure(scrollregion=self.catalog_canvas.bbox("all")))
 
         self.refresh_catalog()
 
@@ -428,56 +1380,242 @@ class HotWheelsApp:
         self.add_car_button.place(relx=1.0, rely=1.0, anchor='se', x=-20, y=-20)
         self.add_car_button.place(relx=1.0, rely=1.0, anchor='se', x=-20, y=-20)
 
-    def apply_search(self):
-        term = self.search_var.get().lower()
-        self.filtered_catalog = [car for car in self.catalog if
-                                 term in car['model'].lower() or term in car['brand'].lower()]
-        self.refresh_catalog()
-
-    def refresh_catalog(self):
-        for widget in self.catalog_frame.winfo_children():
-            widget.destroy()
+    def schedule_search(self):
+        # Restart the debounce timer so a burst of keystrokes runs a single search.
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(SEARCH_DEBOUNCE_MS, self.apply_search)
 
+    @profiler.timed("apply_search")
+    def apply_search(self):
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+            self._search_job = None
+        view = self.view_settings()
+        if view == self._applied_view:
+            return
+        if self._applied_view is None or (view["sort"], view["reverse"]) != (self._applied_view["sort"],
+                                                                             self._applied_view["reverse"]):
+            # The grid only diffs which cards are shown, so a new order needs a full re-layout.
+            self.catalog_grid.forget()
+        self.filter_catalog()
+        self.catalog_grid.update_sections(self.brand_sections())
+
+    @staticmethod
+    def parse_bound(text):
+        try:
+            return float(text) if text.strip() else None
+        except ValueError:
+            return None
+
+    def view_settings(self):
+        ranges = {}
+        for field, (low, high) in self.range_vars.items():
+            bounds = (self.parse_bound(low.get()), self.parse_bound(high.get()))
+            if bounds != (None, None):
+                ranges[field] = bounds
+        return {"text": self.search_var.get(), "ranges": ranges, "only_opened": self.only_opened_var.get(),
+                "sort": SORT_OPTIONS.get(self.sort_var.get()), "reverse": self.sort_desc_var.get()}
+
+    def view_filtered(self):
+        view = self._applied_view
+        return bool(view["text"].strip() or view["ranges"] or view["only_opened"] or view["sort"] is not None)
+
+    def filter_catalog(self):
+        self._applied_view = self.view_settings()
+        if self.catalog.unloaded and self.view_filtered():
+            self.load_all_brands()
+        self.filtered_catalog = self.catalog.query(**self._applied_view)
+
+    def brand_sections(self):
+        # Grouped under brand headers unless the user sorted by a column, which shows one flat list.
+        if self._applied_view["sort"] is not None:
+            return [(None, self.filtered_catalog)]
         brand_sections = {}
         for car in self.filtered_catalog:
-            brand = car["brand"]
-            brand_sections.setdefault(brand, []).append(car)
-
-        row = 0
-        for brand in sorted(brand_sections.keys()):
-            brand_label = tk.Label(self.catalog_frame, text=brand, font=("Arial", 11), cursor="hand2", bg="#f0f0f0",
-                                   activebackground="#cccccc")
-            brand_label.grid(row=row, column=0, sticky='w', pady=(10, 0))
-            brand_label.bind("<Button-1>", lambda e, b=brand: self.open_brand_tab(b))
-            row += 1
-            sep = ttk.Separator(self.catalog_frame, orient='horizontal')
-            sep.grid(row=row, column=0, columnspan=4, sticky="ew", pady=(0, 5))
-            row += 1
-
-            for i, car in enumerate(brand_sections[brand]):
-                img_path = os.path.join(THUMB_DIR, car["thumb"])
-                img = Image.open(img_path)
-                if car.get("open_state") == "Open":
-                    red_dot = Image.new('RGBA', (15, 15), (255, 0, 0, 0))
-                    dot_draw = Image.new('L', (15, 15), 0)
-                    for x in range(15):
-                        for y in range(15):
-                            if (x - 7) ** 2 + (y - 7) ** 2 <= 49:
-                                dot_draw.putpixel((x, y), 255)
-                    red_dot.putalpha(dot_draw)
-                    img.paste(red_dot, (img.width - 18, 3), red_dot)
-                photo = ImageTk.PhotoImage(img)
-                label = tk.Label(self.catalog_frame, image=photo, text=car["model"], compound="top", cursor="hand2",
-                                 bg="#f0f0f0")
-                label.bind("<Enter>", lambda e, w=label: w.configure(bg="#cccccc"))
-                label.bind("<Leave>", lambda e, w=label: w.configure(bg="#f0f0f0"))
-                label.image = photo
-                label.grid(row=row + i // 4, column=i % 4, padx=10, pady=10)
-                label.bind("<Button-1>", lambda e, c=car: self.open_detail_tab(c))
-
-            row += (len(brand_sections[brand]) + 3) // 4
-
+            brand_sections.setdefault(car["brand"], []).append(car)
+        if not self.view_filtered():
+            for brand, count in self.catalog.unloaded.items():
+                brand_sections[brand] = ShardSection(brand, count, self.request_shard)
+        return [(brand, brand_sections[brand])
+                for brand in sorted(brand_sections, reverse=self._applied_view["reverse"])]
+
+    @profiler.timed("refresh_cars")
+    def refresh_cars(self, car_ids):
+        # The incremental counterpart of refresh_catalog after an edit: cards that stay on screen
+        # keep their widgets and only the edited ones are drawn again.
+        self.filter_catalog()
+        self.catalog_grid.update_sections(self.brand_sections(), relayout=True)
+        self.catalog_grid.refresh_cards(car_ids)
+        self.refresh_stats()
+        self.update_history_buttons()
+
+    @profiler.timed("refresh_catalog")
+    def refresh_catalog(self):
+        self.filter_catalog()
+        self.catalog_grid.forget()
+        self.catalog_grid.update_sections(self.brand_sections())
+        self.refresh_stats()
+        self.update_history_buttons()
+
+    def open_stats_tab(self):
+        self.load_all_brands()
+        if self.stats_tab is not None:
+            self.notebook.select(self.stats_tab)
+            self.refresh_stats()
+            return
+        tab = ttk.Frame(self.notebook)
+        self.notebook.add(tab, text="Statistics")
+        self.notebook.select(tab)
+        tk.Button(tab, text="Close Tab", command=self.close_stats_tab, cursor="hand2").pack(anchor='ne', padx=5,
+                                                                                            pady=5)
+        self.stats_summary = tk.Label(tab, justify="left", anchor="w", font=("Arial", 11))
+        self.stats_summary.pack(fill="x", padx=10)
+
+        tables = tk.Frame(tab)
+        tables.pack(fill="both", expand=True, padx=10, pady=10)
+        self.stats_tables = {}
+        for name, columns in STATS_TABLES:
+            tree = ttk.Treeview(tables, columns=columns, show="headings", height=15)
+            for column in columns:
+                tree.heading(column, text=column)
+                tree.column(column, width=90 if column else STATS_BAR_WIDTH * 7, anchor="w")
+            tree.pack(side="left", fill="both", expand=True, padx=5)
+            self.stats_tables[name] = tree
+        self.stats_tab = tab
+        self.refresh_stats()
+
+    def close_stats_tab(self):
+        self.close_tab(self.stats_tab)
+        self.stats_tab.destroy()
+        self.stats_tab = None
+
+    def refresh_stats(self):
+        # The engine keeps the aggregates current, so this only redraws a few dozen rows.
+        if self.stats_tab is None:
+            return
+        stats = self.catalog.stats()
+        self.stats_summary.configure(text=(
+            f"Cars: {stats['count']}    Cased: {stats['states']['Cased']}    Open: {stats['states']['Open']}\n"
+            f"Bought: {stats['bought_value']:.2f}    Internet: {stats['internet_value']:.2f}    "
+            f"Gain/loss: {stats['gain']:+.2f}"))
+
+        brands = [(brand, entry["count"], f"{entry['bought_value']:.2f}", f"{entry['internet_value']:.2f}",
+                   f"{entry['gain']:+.2f}") for brand, entry in sorted(stats["brands"].items())]
+        years = [(year or "Unknown", count) for year, count in stats["years"].items()]
+        most = max((count for label, count in stats["values"]), default=0) or 1
+        values = [(label, count, "\u2588" * round(count / most * STATS_BAR_WIDTH)) for label, count in stats["values"]]
+        for name, rows in (("brands", brands), ("years", years), ("values", values)):
+            tree = self.stats_tables[name]
+            tree.delete(*tree.get_children())
+            for row in rows:
+                tree.insert("", "end", values=row)
+
+    def open_profile_tab(self):
+        if self.profile_tab is not None:
+            self.notebook.select(self.profile_tab)
+            self.refresh_profile()
+            return
+        tab = ttk.Frame(self.notebook)
+        self.notebook.add(tab, text="Profile")
+        self.notebook.select(tab)
+        buttons = tk.Frame(tab)
+        buttons.pack(fill="x", padx=5, pady=5)
+        tk.Button(buttons, text="Close Tab", command=self.close_profile_tab, cursor="hand2").pack(side="right")
+        tk.Button(buttons, text="Refresh", command=self.refresh_profile, cursor="hand2").pack(side="left", padx=5)
+        tk.Button(buttons, text="Reset", command=lambda: [profiler.reset(), self.refresh_profile()],
+                  cursor="hand2").pack(side="left", padx=5)
+        self.capture_button = tk.Button(buttons, command=self.toggle_capture, cursor="hand2")
+        self.capture_button.pack(side="left", padx=5)
+        tk.Button(buttons, text="Export JSON...", command=self.export_profile, cursor="hand2").pack(side="left", padx=5)
+
+        self.profile_summary = tk.Label(tab, justify="left", anchor="w", font=("Arial", 10))
+        self.profile_summary.pack(fill="x", padx=10)
+        self.profile_spans = ttk.Treeview(tab, columns=PROFILE_COLUMNS, show="headings", height=14)
+        for column in PROFILE_COLUMNS:
+            self.profile_spans.heading(column, text=column)
+            self.profile_spans.column(column, width=160 if column == "Span" else 80, anchor="w")
+        self.profile_spans.pack(fill="both", expand=True, padx=10, pady=5)
+        self.capture_text = tk.Text(tab, height=12, font=("Courier", 9))
+        self.capture_text.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        self.profile_tab = tab
+        self.refresh_profile()
+
+    def close_profile_tab(self):
+        self.close_tab(self.profile_tab)
+        self.profile_tab.destroy()
+        self.profile_tab = None
+
+    def profile_gauges(self):
+        cache = self.thumb_cache
+        lookups = cache.hits + cache.misses
+        return {
+            "cars": len(self.catalog.cars),
+            "thumb_cache_entries": len(cache.entries),
+            "thumb_cache_mb": round(cache.bytes / (1024 * 1024), 1),
+            "thumb_cache_hit_rate": round(cache.hits / lookups, 3) if lookups else None,
+            "thumb_atlas_tiles": len(self.thumb_atlas),
+            "grid_card_widgets": len(self.catalog_grid.card_pool),
+            "grid_header_widgets": len(self.catalog_grid.header_pool),
+            "widgets": count_widgets(self.root),
+            "pending_jobs": self.jobs.pending,
+        }
+
+    def refresh_profile(self):
+        if self.profile_tab is None:
+            return
+        summary = profiler.summary()
+        gauges = self.profile_gauges()
+        hit_rate = gauges["thumb_cache_hit_rate"]
+        counters = "    ".join(f"{name}: {value}" for name, value in summary["counters"].items())
+        self.profile_summary.configure(text=(
+            f"Cars: {gauges['cars']}    Widgets: {gauges['widgets']} "
+            f"({gauges['grid_card_widgets']} cards, {gauges['grid_header_widgets']} headers)    "
+            f"Pending jobs: {gauges['pending_jobs']}\n"
+            f"Thumbnail cache: {gauges['thumb_cache_entries']} entries, {gauges['thumb_cache_mb']} MB, "
+            f"hit rate {'-' if hit_rate is None else f'{hit_rate:.1%}'}, {gauges['thumb_atlas_tiles']} atlas tiles\n"
+            f"{counters}"))
+        self.profile_spans.delete(*self.profile_spans.get_children())
+        for name, span in summary["spans"].items():
+            self.profile_spans.insert("", "end", values=(name, span["count"], span["p50_ms"], span["p95_ms"],
+                                                         span["max_ms"], span["total_ms"]))
+        self.capture_button.configure(text="Stop cProfile" if profiler.capturing else "Start cProfile")
+
+    def toggle_capture(self):
+        if not profiler.capturing:
+            profiler.start_capture()
+        else:
+            report = profiler.stop_capture()
+            self.capture_text.delete("1.0", tk.END)
+            self.capture_text.insert(tk.END, f"Saved to {PROFILE_STATS_FILE}\n{report}")
+        self.refresh_profile()
+
+    def export_profile(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", initialfile=PROFILE_FILE,
+                                            filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            profiler.export(path, extra={"gauges": self.profile_gauges()})
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not export the profile: {e}")
+            return
+        messagebox.showinfo("Exported", f"Profile written to {path}.")
+
+    def card_image(self, car, badge=True):
+        if car["id"] in self.pending_thumbs:
+            if self.placeholder_photo is None:
+                self.placeholder_photo = ImageTk.PhotoImage(blank_image(THUMB_SIZE))
+            return self.placeholder_photo
+        if badge and car.get("open_state") == "Open":
+            return self.thumb_cache.get(car, "open", composite_open_badge)
+        return self.thumb_cache.get(car)
+
+    @profiler.timed("open_detail_tab")
     def open_detail_tab(self, car):
+        if car["id"] in self.pending_thumbs:
+            messagebox.showinfo("Busy", "This car's image is still being processed.")
+            return
         for tab_id in self.notebook.tabs():
             if self.notebook.tab(tab_id, "text") == car["model"]:
                 self.notebook.select(tab_id)
@@ -486,30 +1624,30 @@ class HotWheelsApp:
         tab = ttk.Frame(self.notebook)
         self.notebook.add(tab, text=car["model"])
         self.notebook.select(tab)
+        self.detail_tabs[car["id"]] = tab
 
         tk.Button(tab, text="Close Tab", command=lambda: self.close_tab(tab), cursor="hand2").pack(anchor='ne', padx=5,
                                                                                                    pady=5)
 
                 # Display brand logo in top-left if available
-        brand_logo_path = os.path.join(IMAGE_DIR, f"{car['brand'].replace(' ', '_')}_logo.png")
-        if not os.path.exists(brand_logo_path):
-            brand_logo_path = os.path.join(IMAGE_DIR, f"{car['brand'].replace(' ', '_')}_logo.jpg")
-        if os.path.exists(brand_logo_path):
-            logo_img = Image.open(brand_logo_path)
-            logo_img.thumbnail((160, 160))
+        brand_logo_path = find_brand_logo(car['brand'])
+        if brand_logo_path:
+            logo_img = open_image(brand_logo_path, BRAND_LOGO_SIZE)
+            logo_img.thumbnail((BRAND_LOGO_SIZE, BRAND_LOGO_SIZE))
             brand_logo = ImageTk.PhotoImage(logo_img)
             logo_label = tk.Label(tab, image=brand_logo)
             logo_label.image = brand_logo
             logo_label.pack(anchor='nw', padx=10, pady=(5, 0))
 
-        full_img_path = os.path.join(IMAGE_DIR, car["image"])
-        full_img = Image.open(full_img_path)
-        full_img.thumbnail((300, 300))
-        full_photo = ImageTk.PhotoImage(full_img)
+        try:
+            full_photo = ImageTk.PhotoImage(decoded_rendition(car, DETAIL_IMAGE_SIZE))
+        except OSError:
+            full_photo = ImageTk.PhotoImage(blank_image((DETAIL_IMAGE_SIZE, DETAIL_IMAGE_SIZE)))
 
-        img_label = tk.Label(tab, image=full_photo)
+        img_label = tk.Label(tab, image=full_photo, cursor="hand2")
         img_label.image = full_photo
         img_label.pack()
+        img_label.bind("<Button-1>", lambda e: self.open_image_viewer(car))
 
         tk.Button(tab, text="Change Image", command=lambda: self.change_car_image(car, img_label), cursor="hand2").pack(
             pady=5)
@@ -550,44 +1688,68 @@ class HotWheelsApp:
         if not file_path:
             return
 
-        image_dest = os.path.join(IMAGE_DIR, car["image"])
-        thumb_dest = os.path.join(THUMB_DIR, car["thumb"])
+        if car["id"] in self.pending_thumbs:
+            messagebox.showinfo("Busy", "This car's image is still being processed.")
+            return
 
-        shutil.copy(file_path, image_dest)
-        create_thumbnail(image_dest, thumb_dest)
+        def replace_image():
+            image, thumb, phash = ingest_image(file_path, self.thumb_atlas)
+            return image, thumb, phash, decoded_rendition({"image": image, "thumb": thumb}, DETAIL_IMAGE_SIZE)
+
+        def image_replaced(result):
+            image, thumb, phash, img = result
+            self.pending_thumbs.discard(car["id"])
+            self.thumb_cache.invalidate(car["id"])
+            if img_label.winfo_exists():
+                updated_photo = ImageTk.PhotoImage(img)
+                img_label.configure(image=updated_photo)
+                img_label.image = updated_photo
+            self.catalog.change_image(car, image, thumb, phash)
+            self.catalog.release_images()
+            self.catalog_grid.refresh_card(car["id"])
+            self.update_history_buttons()
+            self.warn_similar(car)
+            messagebox.showinfo("Updated", "Image updated successfully.")
+
+        def replace_failed(error):
+            self.pending_thumbs.discard(car["id"])
+            self.catalog.release_images()
+            self.catalog_grid.refresh_card(car["id"])
+            messagebox.showerror("Error", f"Could not update image: {error}")
+
+        self.pending_thumbs.add(car["id"])
+        self.catalog.hold_images()
+        self.catalog_grid.refresh_card(car["id"])
+        self.jobs.submit(replace_image, on_done=image_replaced, on_error=replace_failed)
+
+    def open_image_viewer(self, car):
+        if car["id"] in self.pending_thumbs:
+            return
 
-        img = Image.open(image_dest).resize((300, 300))
-        updated_photo = ImageTk.PhotoImage(img)
-        img_label.configure(image=updated_photo)
-        img_label.image = updated_photo
+        def show(img):
+            viewer = tk.Toplevel(self.root)
+            viewer.title(car["model"])
+            photo = ImageTk.PhotoImage(img)
+            label = tk.Label(viewer, image=photo)
+            label.image = photo
+            label.pack()
 
-        save_catalog(self.catalog)
-        self.refresh_catalog()
-        messagebox.showinfo("Updated", "Image updated successfully.")
+        self.jobs.submit(decoded_rendition, car, VIEWER_IMAGE_SIZE, on_done=show,
+                         on_error=lambda error: messagebox.showerror("Error", f"Could not open image: {error}"))
 
     def duplicate_car(self, car):
-        new_car = car.copy()
-        new_id = str(uuid.uuid4())
-        ext = os.path.splitext(new_car["image"])[1]
-        new_car["id"] = new_id
-        new_car["image"] = f"{new_id}{ext}"
-        new_car["thumb"] = f"{new_id}_thumb{ext}"
-
-        shutil.copy(os.path.join(IMAGE_DIR, car["image"]), os.path.join(IMAGE_DIR, new_car["image"]))
-        shutil.copy(os.path.join(THUMB_DIR, car["thumb"]), os.path.join(THUMB_DIR, new_car["thumb"]))
-
-        self.catalog.append(new_car)
-        self.filtered_catalog = self.catalog.copy()
-        save_catalog(self.catalog)
+        if car["id"] in self.pending_thumbs:
+            messagebox.showinfo("Busy", "This car's image is still being processed.")
+            return
+        self.catalog.duplicate_car(car)
         self.refresh_catalog()
         messagebox.showinfo("Duplicated", f"{car['model']} duplicated successfully.")
 
     def delete_car(self, car, tab):
         confirm = messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {car['model']}?")
         if confirm:
-            self.catalog = [c for c in self.catalog if c['id'] != car['id']]
-            self.filtered_catalog = self.catalog.copy()
-            save_catalog(self.catalog)
+            self.catalog.delete_car(car)
+            self.thumb_cache.invalidate(car['id'])
             self.refresh_catalog()
             self.close_tab(tab)
 
@@ -596,63 +1758,68 @@ class HotWheelsApp:
             if self.notebook.tab(tab_id, "text") == brand:
                 self.notebook.select(tab_id)
                 return
+        if brand in self.catalog.unloaded:
+            try:
+                self.catalog.load_brand(brand)
+            except (OSError, ValueError) as e:
+                self.catalog_load_failed(e)
+                return
+            if self._load_refresh_job is None:
+                self._load_refresh_job = self.root.after_idle(self.show_loaded_cars)
 
         tab = ttk.Frame(self.notebook)
         self.notebook.add(tab, text=brand)
         self.notebook.select(tab)
 
-        tk.Button(tab, text="Close Tab", command=lambda: self.close_tab(tab)).pack(anchor='ne', padx=5, pady=5)
+        # Destroying the tab on close drops its widget pool and the PhotoImages they hold.
+        tk.Button(tab, text="Close Tab", command=lambda: [self.close_tab(tab), tab.destroy()]).pack(
+            anchor='ne', padx=5, pady=5)
         tk.Label(tab, text=brand, font=("Arial", 14, "bold"), anchor="center").pack(pady=(0, 5))
         ttk.Separator(tab, orient='horizontal').pack(fill='x', padx=10, pady=(0, 10))
 
         canvas = tk.Canvas(tab)
-        frame = ttk.Frame(canvas)
         scrollbar = ttk.Scrollbar(tab, orient="vertical", command=canvas.yview)
-        canvas.configure(yscrollcommand=scrollbar.set)
+        grid = VirtualGrid(canvas, scrollbar, lambda car: self.card_image(car, badge=False), self.open_detail_tab)
 
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
-        canvas.create_window((0, 0), window=frame, anchor="nw")
-
-        frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
 
-        brand_cars = [car for car in self.catalog if car["brand"] == brand]
-        for i, car in enumerate(brand_cars):
-            img_path = os.path.join(THUMB_DIR, car["thumb"])
-            img = Image.open(img_path)
-            photo = ImageTk.PhotoImage(img)
-            label = tk.Label(frame, image=photo, text=car["model"], compound="top", cursor="hand2", bg="#f0f0f0")
-            label.bind("<Enter>", lambda e, w=label: w.configure(bg="#cccccc"))
-            label.bind("<Leave>", lambda e, w=label: w.configure(bg="#f0f0f0"))
-            label.image = photo
-            label.grid(row=i // 4, column=i % 4, padx=10, pady=10)
-            label.bind("<Button-1>", lambda e, c=car: self.open_detail_tab(c))
+        grid.set_sections([(None, BrandPager(self.catalog.brands.bucket(brand)))])
 
     def close_tab(self, tab):
+        for car_id, detail_tab in list(self.detail_tabs.items()):
+            if detail_tab is tab:
+                del self.detail_tabs[car_id]
         self.notebook.forget(tab)
         self.notebook.select(self.catalog_tab)
 
     def save_edited_car(self, car, tab):
+        values = {}
         for key, entry in self.detail_entries.items():
             if key == "open_state":
-                car[key] = "Cased" if entry.get() else "Open"
+                values[key] = "Cased" if entry.get() else "Open"
             else:
-                value = entry.get().strip()
-                if key in ['bought_value', 'internet_value', 'year']:
-                    try:
-                        value = float(value)
-                    except ValueError:
-                        messagebox.showerror("Error", f"{key.replace('_', ' ').title()} must be a number.")
-                        return
-                car[key] = value
-
-        save_catalog(self.catalog)
+                values[key] = entry.get()
+        try:
+            changes = parse_car_fields(values)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        self.catalog.update_car(car, changes)
         self.refresh_catalog()
         messagebox.showinfo("Success", "Car details updated.")
         self.close_tab(tab)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hot Wheels catalog.")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"open the profile tab, capture a cProfile of the session and write {PROFILE_FILE} "
+                             f"and {PROFILE_STATS_FILE} on exit")
+    args = parser.parse_args()
+    if args.profile:
+        profiler.start_capture()
     root = tk.Tk()
-    app = HotWheelsApp(root)
+    app = HotWheelsApp(root, profile=args.profile)
     root.mainloop()
@@ -0,0 +1,2563 @@
+import os
+import re
+import sys
+import json
+import uuid
+import hashlib
+import shutil
+import shlex
+import bisect
+import csv
+import time
+import multiprocessing
+import sqlite3
+import itertools
+import functools
+import threading
+import platform
+import cProfile
+import pstats
+import io
+import mmap
+import html
+from array import array
+from urllib.parse import quote
+from contextlib import contextmanager
+from collections import Counter, defaultdict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+DATA_FILE = "catalog.json"
+DB_FILE = "catalog.db"
+SHARD_DIR = "catalog_shards"
+SHARD_MANIFEST = "manifest.json"
+STORAGE_BACKEND = "sqlite"  # or "json", or "shards" for one file per brand
+BRAND_FILE = "brands.json"
+IMAGE_DIR = "images"
+THUMB_DIR = os.path.join(IMAGE_DIR, "thumbs")
+RENDITION_DIR = os.path.join(IMAGE_DIR, "renditions")
+RENDITION_SIZES = (100, 300, 800)
+INGEST_RENDITIONS = (300,)
+THUMB_SIZE = (RENDITION_SIZES[0], RENDITION_SIZES[0])
+RENDITION_BACKGROUND = (240, 240, 240)
+
+SEARCH_FIELDS = ("model", "brand", "notes", "year")
+NGRAM_SIZE = 3
+
+CAR_FIELDS = ("brand", "model", "year", "bought_value", "internet_value", "notes", "open_state")
+NUMERIC_FIELDS = ("year", "bought_value", "internet_value")
+EXPORT_FIELDS = ("id",) + CAR_FIELDS + ("image", "thumb")
+EXPORT_FORMATS = ("csv", "jsonl", "json", "html")
+EXPORT_COPY_THREADS = 8
+EXPORT_PROGRESS_EVERY = 1000
+RECORD_FIELDS = CAR_FIELDS + ("image", "thumb", "id", "phash")
+INTERNED_FIELDS = ("brand", "open_state")
+
+VALUE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+UNDO_LIMIT = 100
+BATCH_OPERATIONS = ("set", "add", "percent", "append")
+
+JSON_READ_CHUNK = 1 << 16
+LOAD_FIRST_BATCH = 1000
+LOAD_BATCH_SIZE = 5000
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+IMPORT_FIELDS = ("brand", "model", "year", "bought_value", "internet_value", "notes", "open_state", "image")
+IMPORT_PROGRESS_FILE = "import_progress.jsonl"
+IMPORT_PROCESSES = os.cpu_count() or 2
+IMAGE_SCAN_CACHE = "image_scan.json"
+THUMB_ATLAS = "thumbs.atlas"
+THUMB_ATLAS_INDEX = "thumbs.atlas.idx"
+ORPHAN_MIN_AGE = 600
+PHASH_SIZE = 8
+PHASH_SEGMENTS = 4
+DUPLICATE_DISTANCE = 6
+
+PROFILE_SAMPLES = 1000
+PROFILE_FILE = "profile.json"
+PROFILE_STATS_FILE = "profile.pstats"
+
+DEFAULT_BRANDS = ["HotWheels", "Matchbox", "Majorette"]
+
+
+def ensure_dirs():
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    os.makedirs(RENDITION_DIR, exist_ok=True)
+
+
+def percentile(values, fraction):
+    # values must be sorted and non-empty.
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class Profiler:
+    # Named timing spans and counters around the hot paths. A span keeps an all-time count and
+    # total plus its last `samples` durations, which the percentiles are taken over. Cheap
+    # enough to be always on; a cProfile capture of the calling thread can be added on demand.
+    def __init__(self, samples=PROFILE_SAMPLES):
+        self.samples = samples
+        self.spans = {}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self._capture = None
+
+    def record(self, name, seconds):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = [0, 0.0, deque(maxlen=self.samples)]
+            span[0] += 1
+            span[1] += seconds
+            span[2].append(seconds)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = Counter()
+
+    def summary(self):
+        with self._lock:
+            spans = [(name, count, total, sorted(recent)) for name, (count, total, recent) in self.spans.items()]
+            counters = dict(sorted(self.counters.items()))
+        return {
+            "spans": {name: {"count": count, "total_ms": round(total * 1000, 3),
+                             "p50_ms": round(percentile(recent, 0.5) * 1000, 3),
+                             "p95_ms": round(percentile(recent, 0.95) * 1000, 3),
+                             "max_ms": round(recent[-1] * 1000, 3)}
+                      for name, count, total, recent in sorted(spans)},
+            "counters": counters,
+        }
+
+    @property
+    def capturing(self):
+        return self._capture is not None
+
+    def start_capture(self):
+        if self._capture is None:
+            self._capture = cProfile.Profile()
+            self._capture.enable()
+
+    def stop_capture(self, path=PROFILE_STATS_FILE, limit=25):
+        # Saves the capture for pstats/snakeviz and returns its top entries by cumulative time.
+        capture, self._capture = self._capture, None
+        if capture is None:
+            return ""
+        capture.disable()
+        capture.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(capture, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def export(self, path=PROFILE_FILE, extra=None):
+        # A JSON snapshot meant to be diffed between releases; `extra` adds gauges of the caller.
+        data = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                "platform": platform.platform()}
+        data.update(self.summary())
+        if extra:
+            data.update(extra)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+        return data
+
+
+profiler = Profiler()
+
+
+_MISSING = object()
+_RECORD_FIELD_SET = frozenset(RECORD_FIELDS)
+_INTERNED_FIELD_SET = frozenset(INTERNED_FIELDS)
+_SEARCH_FIELD_SET = frozenset(SEARCH_FIELDS)
+
+
+class Car(MutableMapping):
+    # One catalog record. The known fields live in slots rather than a per-record dict and the
+    # repetitive strings are interned, which keeps a large catalog compact; unknown keys go to
+    # `extra`. It behaves like the dict it replaces, and to_dict() gives one back for json.
+    __slots__ = RECORD_FIELDS + ("extra",)
+
+    def __init__(self, data=(), **kwargs):
+        self.extra = None
+        self.update(data, **kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        # The hot path of every load, so it sets the slots through their descriptors directly.
+        car = cls.__new__(cls)
+        extra = None
+        for key, value in data.items():
+            setter = _SLOT_SETTERS.get(key)
+            if setter is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+            else:
+                setter(car, value)
+        car.extra = extra
+        for key in INTERNED_FIELDS:
+            value = getattr(car, key, None)
+            if type(value) is str:
+                setattr(car, key, sys.intern(value))
+        return car
+
+    def to_dict(self):
+        data = {}
+        for key in RECORD_FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key):
+        if key in _RECORD_FIELD_SET:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in _RECORD_FIELD_SET:
+            return getattr(self, key, default)
+        return default if self.extra is None else self.extra.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key in _RECORD_FIELD_SET:
+            if key in _INTERNED_FIELD_SET and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _RECORD_FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in RECORD_FIELDS:
+            if getattr(self, key, _MISSING) is not _MISSING:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def copy(self):
+        return Car.from_dict(self)
+
+    def __repr__(self):
+        return f"Car({self.to_dict()!r})"
+
+
+_SLOT_SETTERS = {key: getattr(Car, key).__set__ for key in RECORD_FIELDS}
+
+
+_JSON_SKIP = re.compile(r'[\s,]*')
+
+
+def iter_json_array(f, chunk_size=JSON_READ_CHUNK):
+    # Yields the elements of a top-level JSON array while reading the file a chunk at a time,
+    # so the first records are available long before the end of a large file is parsed.
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size).lstrip()
+    if not buf:
+        return
+    if not buf.startswith('['):
+        raise ValueError("Expected a JSON array.")
+    pos = 1
+    while True:
+        pos = _JSON_SKIP.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+            if end == len(buf):
+                raise ValueError  # may have stopped at the chunk boundary
+        except ValueError:
+            more = f.read(chunk_size)
+            if not more:
+                raise ValueError("Truncated or malformed JSON array.")
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield value
+        pos = end
+
+
+class JsonCatalogStore:
+    # The original single-file layout: every commit rewrites the whole file, but through a
+    # temporary file and os.replace so a crash never leaves it half written.
+    partial_commits = False
+    lazy_brands = False
+
+    def __init__(self, path=DATA_FILE):
+        self.path = path
+
+    def iter_load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for data in iter_json_array(f):
+                    yield Car.from_dict(data)
+
+    def load(self):
+        return list(self.iter_load())
+
+    def commit(self, catalog, changed=None, deleted=None, exclude=()):
+        if exclude:
+            catalog = [car for car in catalog if car["id"] not in exclude]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(catalog, f, indent=4, default=Car.to_dict)
+        os.replace(tmp_path, self.path)
+
+    def rename_brand(self, catalog, old_brand, new_brand, exclude=()):
+        self.commit(catalog, exclude=exclude)
+
+
+class SqliteCatalogStore:
+    # One row per car, so upserts and deletes touch only the records that changed and each
+    # commit is a single atomic transaction. Rows keep their rowid on update, which preserves
+    # catalog order.
+    partial_commits = True
+    lazy_brands = False
+
+    def __init__(self, path=DB_FILE, legacy_path=DATA_FILE):
+        is_new = not os.path.exists(path)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cars (id TEXT PRIMARY KEY, brand TEXT, data TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cars_brand ON cars (brand)")
+        self.conn.commit()
+        if is_new and legacy_path and os.path.exists(legacy_path):
+            self.migrate(legacy_path)
+
+    def migrate(self, legacy_path):
+        catalog = JsonCatalogStore(legacy_path).load()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO cars (id, brand, data) VALUES (?, ?, ?)",
+                                  [(car["id"], car["brand"], json.dumps(car.to_dict())) for car in catalog])
+        os.replace(legacy_path, legacy_path + ".migrated")
+
+    def iter_load(self):
+        # Reads through a connection of its own, so the catalog can stream in on a worker thread
+        # while the main connection keeps committing.
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            for data, in conn.execute("SELECT data FROM cars ORDER BY rowid"):
+                yield Car.from_dict(json.loads(data))
+        finally:
+            conn.close()
+
+    def load(self):
+        rows = self.conn.execute("SELECT data FROM cars ORDER BY rowid")
+        return [Car.from_dict(json.loads(data)) for data, in rows]
+
+    def commit(self, catalog, changed=None, deleted=None, exclude=()):
+        with self.conn:
+            if changed is None and deleted is None:
+                self.conn.execute("DELETE FROM cars")
+                changed = [car for car in catalog if car["id"] not in exclude]
+            elif exclude:
+                changed = [car for car in changed or () if car["id"] not in exclude]
+            if deleted:
+                self.conn.executemany("DELETE FROM cars WHERE id = ?", [(car_id,) for car_id in deleted])
+            if changed:
+                self.conn.executemany(
+                    "INSERT INTO cars (id, brand, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET brand = excluded.brand, data = excluded.data",
+                    [(car["id"], car["brand"], json.dumps(car.to_dict())) for car in changed])
+
+    def rename_brand(self, catalog, old_brand, new_brand, exclude=()):
+        with self.conn:
+            self.conn.execute("UPDATE cars SET brand = ?, data = json_set(data, '$.brand', ?) WHERE brand = ?",
+                              (new_brand, new_brand, old_brand))
+
+    def close(self):
+        self.conn.close()
+
+
+def shard_file_name(brand):
+    slug = re.sub(r'[^0-9A-Za-z]+', '_', brand).strip('_').lower()[:40] or "brand"
+    return f"{slug}-{hashlib.blake2b(brand.encode('utf-8'), digest_size=4).hexdigest()}.json"
+
+
+def write_json_file(path, data):
+    tmp_path = partial_path(path)
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, default=Car.to_dict)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ShardedCatalogStore:
+    # One JSON file per brand in SHARD_DIR and a manifest of the brands with their files and car
+    # counts, so opening the catalog reads only the manifest and a brand can be read on its own
+    # (see Catalog.read_shard). The brand is implied by the shard rather than stored in each
+    # record, which makes renaming a brand a file rename plus a manifest update. A commit rewrites
+    # just the shards of brands whose cars changed; that relies on the catalog holding every car
+    # of such a brand, which mark_loaded records.
+    partial_commits = True
+    lazy_brands = True
+
+    def __init__(self, folder=SHARD_DIR, legacy_paths=(DB_FILE, DATA_FILE)):
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, SHARD_MANIFEST)
+        self.shards = {}
+        self.loaded = set()
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                self.shards = {entry["brand"]: entry for entry in json.load(f)["brands"]}
+            self.finish_renames()
+        else:
+            self.migrate(legacy_paths)
+
+    def shard_path(self, name):
+        return os.path.join(self.folder, name)
+
+    def write_manifest(self):
+        write_json_file(self.manifest_path, {"brands": list(self.shards.values())})
+
+    def finish_renames(self):
+        # A rename records the shard's previous file in the manifest before moving it, so one
+        # interrupted in between is completed here.
+        renamed = False
+        for entry in self.shards.values():
+            previous = entry.pop("previous", None)
+            if previous is None:
+                continue
+            renamed = True
+            if not os.path.exists(self.shard_path(entry["file"])) and os.path.exists(self.shard_path(previous)):
+                os.replace(self.shard_path(previous), self.shard_path(entry["file"]))
+        if renamed:
+            self.write_manifest()
+
+    def migrate(self, legacy_paths):
+        for path in legacy_paths:
+            if not os.path.exists(path):
+                continue
+            if path == DB_FILE:
+                store = SqliteCatalogStore(path, legacy_path=None)
+                catalog = store.load()
+                store.close()
+            else:
+                catalog = JsonCatalogStore(path).load()
+            self.commit(catalog)
+            self.loaded = set()  # written from the legacy file, not loaded into any catalog
+            os.replace(path, path + ".migrated")
+            return
+        self.write_manifest()
+
+    def brand_counts(self):
+        return {brand: entry["count"] for brand, entry in self.shards.items()}
+
+    def read_shard(self, brand):
+        entry = self.shards.get(brand)
+        if entry is None:
+            return
+        with open(self.shard_path(entry["file"]), 'r') as f:
+            for data in iter_json_array(f):
+                data["brand"] = brand
+                yield Car.from_dict(data)
+
+    def mark_loaded(self, brand):
+        self.loaded.add(brand)
+
+    def iter_load(self):
+        for brand in list(self.shards):
+            yield from self.read_shard(brand)
+
+    def load(self):
+        return list(self.iter_load())
+
+    def commit(self, catalog, changed=None, deleted=None, exclude=()):
+        # Without changed/deleted every shard is rewritten. Otherwise a loaded brand is rewritten
+        # when one of its cars changed or its count no longer matches the manifest, which also
+        # covers cars deleted or moved to another brand.
+        if changed is None and deleted is None:
+            touched = None
+        else:
+            touched = {car["brand"] for car in changed or ()}
+            counts = Counter(car["brand"] for car in catalog if car["id"] not in exclude)
+            touched.update(brand for brand in self.loaded
+                           if counts[brand] != self.shards.get(brand, {}).get("count", 0))
+        shards = defaultdict(list)
+        for car in catalog:
+            if (touched is None or car["brand"] in touched) and car["id"] not in exclude:
+                record = car.to_dict()
+                del record["brand"]
+                shards[car["brand"]].append(record)
+        removed = []
+        for brand in (self.shards.keys() | shards.keys()) if touched is None else touched:
+            records = shards.get(brand, [])
+            entry = self.shards.get(brand)
+            if records:
+                if entry is None:
+                    entry = self.shards[brand] = {"brand": brand, "file": shard_file_name(brand), "count": 0}
+                write_json_file(self.shard_path(entry["file"]), records)
+                entry["count"] = len(records)
+                self.loaded.add(brand)
+            elif entry is not None:
+                removed.append(self.shards.pop(brand)["file"])
+        self.write_manifest()
+        for name in removed:
+            if os.path.exists(self.shard_path(name)):
+                os.remove(self.shard_path(name))
+
+    def rename_brand(self, catalog, old_brand, new_brand, exclude=()):
+        entry = self.shards.pop(old_brand, None)
+        if old_brand in self.loaded:
+            self.loaded.discard(old_brand)
+            self.loaded.add(new_brand)
+        if entry is None:
+            return
+        previous = entry["file"]
+        entry.update(brand=new_brand, file=shard_file_name(new_brand), previous=previous)
+        self.shards[new_brand] = entry
+        self.write_manifest()
+        os.replace(self.shard_path(previous), self.shard_path(entry["file"]))
+        del entry["previous"]
+        self.write_manifest()
+
+
+_catalog_store = None
+
+
+def catalog_store():
+    global _catalog_store
+    if _catalog_store is None:
+        if STORAGE_BACKEND == "shards":
+            _catalog_store = ShardedCatalogStore()
+        elif STORAGE_BACKEND == "sqlite":
+            _catalog_store = SqliteCatalogStore()
+        else:
+            _catalog_store = JsonCatalogStore()
+    return _catalog_store
+
+
+def reset_catalog_store():
+    # The store is opened on first use relative to the working directory; callers that change
+    # directory (or STORAGE_BACKEND) reset it so the next use opens the right one.
+    global _catalog_store
+    if isinstance(_catalog_store, SqliteCatalogStore):
+        _catalog_store.close()
+    _catalog_store = None
+
+
+@profiler.timed("load_catalog")
+def load_catalog():
+    return catalog_store().load()
+
+
+def iter_catalog():
+    return catalog_store().iter_load()
+
+
+@profiler.timed("save_catalog")
+def save_catalog(catalog, changed=None, deleted=None, exclude=()):
+    # With changed/deleted given only those records are written; otherwise the store is replaced.
+    catalog_store().commit(catalog, changed, deleted, exclude)
+
+
+def rename_catalog_brand(catalog, old_brand, new_brand, exclude=()):
+    catalog_store().rename_brand(catalog, old_brand, new_brand, exclude)
+
+
+def load_brands():
+    if os.path.exists(BRAND_FILE):
+        with open(BRAND_FILE, 'r') as f:
+            return json.load(f)
+    return DEFAULT_BRANDS.copy()
+
+
+def save_brands(brand_list):
+    with open(BRAND_FILE, 'w') as f:
+        json.dump(brand_list, f, indent=4)
+
+
+def open_image(path, size=None):
+    # For JPEGs draft() lets the decoder scale down by up to 8x while decoding, which is far
+    # cheaper than decoding a full-size photo only to shrink it.
+    img = Image.open(path)
+    if size and img.format == "JPEG":
+        img.draft("RGB", (size, size))
+    return img
+
+
+def save_rendition(img, path):
+    if os.path.splitext(path)[1].lower() in ('.jpg', '.jpeg'):
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            flat = Image.new('RGB', img.size, RENDITION_BACKGROUND)
+            flat.paste(img, mask=img.getchannel('A'))
+            img = flat
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(path, "JPEG", quality=85)
+    else:
+        img.save(path)
+
+
+@profiler.timed("build_renditions")
+def build_renditions(image_path, outputs):
+    # outputs is a list of (size, path). A single reduced decode of the original serves all of
+    # them, shrinking the same image from the largest size down.
+    outputs = sorted(outputs, reverse=True)
+    img = open_image(image_path, outputs[0][0])
+    for size, path in outputs:
+        img.thumbnail((size, size))
+        save_rendition(img, path)
+
+
+@profiler.timed("create_thumbnail")
+def create_thumbnail(image_path, thumb_path):
+    build_renditions(image_path, [(THUMB_SIZE[0], thumb_path)])
+
+
+def rendition_path(image_name, size):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return os.path.join(RENDITION_DIR, f"{stem}_{size}.jpg")
+
+
+def partial_path(path):
+    # Unique per call, since two workers may be writing the same content-addressed file.
+    root, ext = os.path.splitext(path)
+    return f"{root}.{uuid.uuid4().hex[:8]}.partial{ext}"
+
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_hash(img):
+    # dHash: one bit per pixel of a 9x8 greyscale shrink, set where the pixel is brighter than its
+    # right neighbour. Re-encoding, resizing and small exposure changes flip few bits, so two
+    # photos of the same thing end up a small Hamming distance apart. Flat images hash to 0.
+    small = img.convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(0, len(pixels), PHASH_SIZE + 1):
+        for col in range(row, row + PHASH_SIZE):
+            value = value << 1 | (pixels[col] > pixels[col + 1])
+    return f"{value:0{PHASH_SIZE * PHASH_SIZE // 4}x}"
+
+
+def thumb_name(image_name):
+    stem, ext = os.path.splitext(image_name)
+    return f"{stem}_thumb{ext}"
+
+
+@profiler.timed("ingest_image")
+def ingest_image(source, atlas=None):
+    # Stores the image under its content hash and returns its (image, thumb, phash). Content that
+    # is already stored is neither copied nor thumbnailed again; its perceptual hash is taken
+    # from the stored thumbnail. New files are built under temporary names and only swapped in
+    # once all succeeded, so a failure never leaves a half-written image behind. A new thumbnail
+    # also goes into `atlas` (see ThumbnailAtlas) when the caller has one open.
+    image_name = hash_file(source) + os.path.splitext(source)[1].lower()
+    image_dest = os.path.join(IMAGE_DIR, image_name)
+    thumb_dest = os.path.join(THUMB_DIR, thumb_name(image_name))
+    if os.path.exists(image_dest) and os.path.exists(thumb_dest):
+        with Image.open(thumb_dest) as img:
+            return image_name, thumb_name(image_name), image_hash(img)
+
+    outputs = [(THUMB_SIZE[0], thumb_dest)]
+    outputs += [(size, rendition_path(image_name, size)) for size in INGEST_RENDITIONS]
+    image_tmp = partial_path(image_dest)
+    tmp_paths = {path: partial_path(path) for size, path in outputs}
+    try:
+        shutil.copy(source, image_tmp)
+        build_renditions(image_tmp, [(size, tmp_paths[path]) for size, path in outputs])
+        # Hashed as written, like stored content above and hash_worker, since JPEG encoding can
+        # move a few bits of the hash.
+        thumb = Image.open(tmp_paths[thumb_dest])
+        thumb.load()
+        phash = image_hash(thumb)
+        os.replace(image_tmp, image_dest)
+        for path, tmp_path in tmp_paths.items():
+            os.replace(tmp_path, path)
+    except BaseException:
+        for path in [image_tmp] + list(tmp_paths.values()):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    if atlas is not None:
+        atlas.put(thumb_name(image_name), thumb)
+    return image_name, thumb_name(image_name), phash
+
+
+def image_file_paths(image_name):
+    # The original first and the thumbnail second, then the cached renditions.
+    paths = [os.path.join(IMAGE_DIR, image_name), os.path.join(THUMB_DIR, thumb_name(image_name))]
+    return paths + [rendition_path(image_name, size) for size in RENDITION_SIZES[1:]]
+
+
+def delete_image_files(image_name):
+    for path in image_file_paths(image_name):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ImageStore:
+    # Reference counts of stored images by name. Identical content (duplicated cars, the
+    # placeholder, re-imported photos) is stored once, so several records can share a file; once
+    # the last reference is released the image becomes garbage and collect() deletes it along
+    # with its thumbnail and renditions.
+    def __init__(self, catalog=()):
+        self.refs = Counter()
+        self.garbage = set()
+        for car in catalog:
+            self.add(car.get("image"))
+
+    def add(self, name):
+        if name:
+            self.refs[name] += 1
+
+    def release(self, name):
+        if not name:
+            return
+        self.refs[name] -= 1
+        if self.refs[name] <= 0:
+            del self.refs[name]
+            self.garbage.add(name)
+
+    def collect(self):
+        removed = [name for name in self.garbage if name not in self.refs]
+        for name in removed:
+            delete_image_files(name)
+        self.garbage = set()
+        return removed
+
+
+class ThumbnailAtlas:
+    # Thumbnails packed into one file (THUMB_ATLAS) as fixed-size raw RGBA tiles and read through
+    # mmap, so showing a card needs neither a file open nor a decode: get() wraps the mapped bytes
+    # without copying them. THUMB_ATLAS_INDEX is an append-only log of (thumb name, tile, width,
+    # height), replayed on open and rewritten once mostly superseded. Thumbnail names are content
+    # hashes, so a tile never goes stale; tiles are added as thumbnails are built or first decoded
+    # and freed by discard/retain. Tiles are written through the file and only read through the
+    # map. Only the process showing thumbnails opens it; pool workers never write to it.
+    def __init__(self, path=THUMB_ATLAS, index_path=THUMB_ATLAS_INDEX):
+        self.path = path
+        self.index_path = index_path
+        self.tile_bytes = THUMB_SIZE[0] * THUMB_SIZE[1] * 4
+        self.tiles = {}
+        self.free = []
+        self.lock = threading.Lock()
+        self.log_lines = 0
+        tile_count = 0
+        torn = False
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                for line in f:
+                    try:
+                        name, tile, width, height = json.loads(line)
+                    except ValueError:
+                        torn = True  # final line of an interrupted write
+                        break
+                    self.log_lines += 1
+                    if tile is None:
+                        self.tiles.pop(name, None)
+                    else:
+                        self.tiles[name] = (tile, width, height)
+                        tile_count = max(tile_count, tile + 1)
+        used = {tile for tile, width, height in self.tiles.values()}
+        self.free = sorted(set(range(tile_count)) - used, reverse=True)
+        self.tile_count = tile_count
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self.map = None
+        self._remap()
+        self.index = open(index_path, 'a')
+        # Rewriting also drops a torn line, which appending after would otherwise corrupt.
+        if torn or self.log_lines > 2 * len(self.tiles) + 1000:
+            self.compact()
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def _remap(self):
+        size = os.fstat(self.file.fileno()).st_size
+        if size and (self.map is None or len(self.map) < size):
+            # The old map stays valid for images still wrapping it and goes once they do.
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, name):
+        # An image over the tile's bytes in the map (read-only; PIL copies it if drawn on), or None.
+        entry = self.tiles.get(name)
+        if entry is None:
+            return None
+        tile, width, height = entry
+        offset = tile * self.tile_bytes
+        if self.map is None or offset + width * height * 4 > len(self.map):
+            return None
+        data = memoryview(self.map)[offset:offset + width * height * 4]
+        return Image.frombuffer("RGBA", (width, height), data, "raw", "RGBA", 0, 1)
+
+    def put(self, name, img):
+        if img.width > THUMB_SIZE[0] or img.height > THUMB_SIZE[1]:
+            img = img.copy()
+            img.thumbnail(THUMB_SIZE)
+        data = img.convert("RGBA").tobytes()
+        with self.lock:
+            entry = self.tiles.get(name)
+            if entry is not None:
+                tile = entry[0]
+            elif self.free:
+                tile = self.free.pop()
+            else:
+                tile = self.tile_count
+                self.tile_count += 1
+            self.file.seek(tile * self.tile_bytes)
+            self.file.write(data)
+            self.file.flush()
+            self.tiles[name] = (tile, img.width, img.height)
+            self._log(name, tile, img.width, img.height)
+            self._remap()
+
+    def discard(self, name):
+        with self.lock:
+            entry = self.tiles.pop(name, None)
+            if entry is not None:
+                self.free.append(entry[0])
+                self._log(name, None, 0, 0)
+
+    def retain(self, names):
+        # Frees the tiles of thumbnails no longer in use, e.g. collected with their image. The
+        # tiles are listed under the lock, since a worker may be putting one meanwhile.
+        with self.lock:
+            stale = [name for name in self.tiles if name not in names]
+        for name in stale:
+            self.discard(name)
+
+    def _log(self, name, tile, width, height):
+        self.index.write(json.dumps([name, tile, width, height]) + "\n")
+        self.index.flush()
+        self.log_lines += 1
+
+    def compact(self):
+        with self.lock:
+            tmp_path = partial_path(self.index_path)
+            with open(tmp_path, 'w') as f:
+                for name, (tile, width, height) in self.tiles.items():
+                    f.write(json.dumps([name, tile, width, height]) + "\n")
+            self.index.close()
+            os.replace(tmp_path, self.index_path)
+            self.index = open(self.index_path, 'a')
+            self.log_lines = len(self.tiles)
+
+    def close(self):
+        self.index.close()
+        self.file.close()
+        self.map = None
+
+
+def list_image_dir(path):
+    # The files directly in `path` with the (size, mtime_ns) the scan cache compares against.
+    files = {}
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        return files
+    with entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def load_scan_cache():
+    try:
+        with open(IMAGE_SCAN_CACHE, 'r') as f:
+            return {path: tuple(stat) for path, stat in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_scan_cache(cache):
+    tmp_path = partial_path(IMAGE_SCAN_CACHE)
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, IMAGE_SCAN_CACHE)
+
+
+def scan_worker(task):
+    # Verifies one stored image and rebuilds its thumbnail if that is missing or unreadable.
+    # Returns (image name, "ok" | "repaired" | "damaged", error).
+    image_name, check_image, check_thumb = task
+    image_path, thumb_path = image_file_paths(image_name)[:2]
+    try:
+        if check_image:
+            with Image.open(image_path) as img:
+                img.verify()
+    except Exception as e:
+        return image_name, "damaged", str(e)
+    if not check_thumb:
+        return image_name, "ok", None
+    try:
+        with Image.open(thumb_path) as img:
+            img.load()
+        return image_name, "ok", None
+    except Exception:
+        pass
+    tmp_path = partial_path(thumb_path)
+    try:
+        create_thumbnail(image_path, tmp_path)
+        os.replace(tmp_path, thumb_path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return image_name, "damaged", f"thumbnail could not be rebuilt: {e}"
+    return image_name, "repaired", None
+
+
+@profiler.timed("scan_images")
+def scan_images(image_names, progress=None):
+    # Cross-checks the referenced images against the image directories, which are listed in
+    # parallel. Files whose size and mtime match IMAGE_SCAN_CACHE were verified by an earlier scan
+    # and are skipped; the rest go to a process pool that also rebuilds missing or broken
+    # thumbnails. Unreferenced files are only reported; Catalog.remove_orphans deletes them.
+    with ThreadPoolExecutor(3) as pool:
+        files = {}
+        for listing in pool.map(list_image_dir, (IMAGE_DIR, THUMB_DIR, RENDITION_DIR)):
+            files.update(listing)
+    cache = load_scan_cache()
+    report = {"checked": 0, "repaired": [], "missing": [], "damaged": [], "orphans": [], "orphan_bytes": 0}
+    expected = set()
+    verified = {}
+    tasks = []
+    for name in image_names:
+        paths = image_file_paths(name)
+        expected.update(paths)
+        image_path, thumb_path = paths[:2]
+        if image_path not in files:
+            report["missing"].append(name)
+            continue
+        check_image = cache.get(image_path) != files[image_path]
+        check_thumb = thumb_path not in files or cache.get(thumb_path) != files[thumb_path]
+        if check_image or check_thumb:
+            tasks.append((name, check_image, check_thumb))
+        else:
+            verified[image_path] = files[image_path]
+            verified[thumb_path] = files[thumb_path]
+
+    if tasks:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(IMPORT_PROCESSES, len(tasks))) as pool:
+            results = pool.imap_unordered(scan_worker, tasks, chunksize=64)
+            for done, (name, status, error) in enumerate(results, 1):
+                if status == "damaged":
+                    report["damaged"].append(f"{name}: {error}")
+                else:
+                    if status == "repaired":
+                        report["repaired"].append(name)
+                    for path in image_file_paths(name)[:2]:
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue  # collected while the scan ran
+                        verified[path] = (stat.st_size, stat.st_mtime_ns)
+                if progress is not None:
+                    progress(done, len(tasks))
+    report["checked"] = len(tasks)
+    save_scan_cache(verified)
+
+    # Recent files may belong to an ingest that has not been committed yet.
+    cutoff = time.time_ns() - ORPHAN_MIN_AGE * 10 ** 9
+    for path, (size, mtime) in sorted(files.items()):
+        if path in expected or mtime > cutoff:
+            continue
+        if os.path.dirname(path) == IMAGE_DIR:
+            name = os.path.basename(path)
+            if name == "placeholder.png" or os.path.splitext(name)[0].endswith("_logo"):
+                continue
+        report["orphans"].append(path)
+        report["orphan_bytes"] += size
+    return report
+
+
+def hash_worker(image_name):
+    # The thumbnail is hashed, as at ingest; the original is the fallback if it is unreadable.
+    image_path, thumb_path = image_file_paths(image_name)[:2]
+    try:
+        with Image.open(thumb_path) as img:
+            return image_name, image_hash(img), None
+    except Exception:
+        pass
+    try:
+        with open_image(image_path, THUMB_SIZE[0]) as img:
+            img.thumbnail(THUMB_SIZE)
+            return image_name, image_hash(img), None
+    except Exception as e:
+        return image_name, None, str(e)
+
+
+@profiler.timed("backfill_hashes")
+def backfill_hashes(image_names, progress=None):
+    # Perceptual hashes for images stored before they were taken at ingest, computed by a process
+    # pool. Returns the hashes by image name and the images that could not be read.
+    hashes = {}
+    failures = []
+    if not image_names:
+        return hashes, failures
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(min(IMPORT_PROCESSES, len(image_names))) as pool:
+        results = pool.imap_unordered(hash_worker, image_names, chunksize=64)
+        for done, (name, phash, error) in enumerate(results, 1):
+            if phash is None:
+                failures.append(f"{name}: {error}")
+            else:
+                hashes[name] = phash
+            if progress is not None:
+                progress(done, len(image_names))
+    return hashes, failures
+
+
+def is_fresh(path, source):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return False
+    try:
+        return mtime >= os.path.getmtime(source)
+    except OSError:
+        return True  # the original is gone, so what was rendered from it is the best there is
+
+
+@profiler.timed("load_rendition")
+def load_rendition(car, size):
+    # The smallest cached rendition that covers `size` px, built from the original on first use
+    # (or when the original is newer). Beyond the largest rendition the original is draft-decoded.
+    image_path = os.path.join(IMAGE_DIR, car["image"])
+    covering = [r for r in RENDITION_SIZES if r >= size]
+    if not covering:
+        img = open_image(image_path, size)
+        img.thumbnail((size, size))
+        return img
+    rendition = covering[0]
+    if rendition == THUMB_SIZE[0]:
+        path = os.path.join(THUMB_DIR, car["thumb"])
+    else:
+        path = rendition_path(car["image"], rendition)
+    if not is_fresh(path, image_path):
+        tmp_path = partial_path(path)
+        build_renditions(image_path, [(rendition, tmp_path)])
+        os.replace(tmp_path, path)
+    img = Image.open(path)
+    if rendition > size:
+        img.thumbnail((size, size))
+    return img
+
+
+def placeholder_image():
+    path = os.path.join(IMAGE_DIR, "placeholder.png")
+    if not os.path.exists(path):
+        Image.new('RGB', (300, 300), color=(200, 200, 200)).save(path)
+    return path
+
+
+def new_car_record(data):
+    # The image fields are copied from data if present; a new car gets them once ingested.
+    car = Car.from_dict(data)
+    car["id"] = str(uuid.uuid4())
+    return car
+
+
+def parse_car_fields(values):
+    # Blank numeric fields count as 0; anything else that is not a number is rejected.
+    data = {}
+    for key, value in values.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if key in NUMERIC_FIELDS:
+            try:
+                value = float(value) if value not in (None, "") else 0.0
+            except ValueError:
+                raise ValueError(f"{key.replace('_', ' ').title()} must be a number.")
+        data[key] = value
+    return data
+
+
+def batch_edits(cars, updates):
+    # updates maps a field to (operation, amount) with the operation one of BATCH_OPERATIONS;
+    # returns the (car, changes) list an EditCars command takes.
+    edits = []
+    for car in cars:
+        changes = {}
+        for field, (operation, amount) in updates.items():
+            if operation == "set":
+                changes[field] = amount
+            elif operation == "append":
+                value = car.get(field)
+                changes[field] = f"{value} {amount}" if value else amount
+            elif operation == "add":
+                changes[field] = column_value(car.get(field)) + amount
+            elif operation == "percent":
+                changes[field] = round(column_value(car.get(field)) * (100 + amount) / 100, 2)
+            else:
+                raise ValueError(f"Unknown operation '{operation}'.")
+        edits.append((car, changes))
+    return edits
+
+
+def brand_logo_path(brand, ext):
+    return os.path.join(IMAGE_DIR, f"{brand.replace(' ', '_')}_logo{ext}")
+
+
+def find_brand_logo(brand):
+    for ext in IMAGE_EXTENSIONS:
+        path = brand_logo_path(brand, ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_import_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith('.json'):
+        with open(path, 'r') as f:
+            rows = json.load(f)
+    else:
+        with open(path, 'r', newline='') as f:
+            rows = list(csv.DictReader(f))
+    for row in rows:
+        image = (row.get("image") or "").strip()
+        row["image"] = os.path.join(base, image) if image else ""
+    return rows
+
+
+def scan_import_folder(folder, default_brand):
+    for name in ("manifest.csv", "manifest.json"):
+        manifest = os.path.join(folder, name)
+        if os.path.exists(manifest):
+            return read_import_manifest(manifest)
+
+    rows = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        # Images in a sub-folder are filed under a brand named after that folder.
+        brand = default_brand if os.path.samefile(dirpath, folder) else os.path.basename(dirpath)
+        for filename in sorted(filenames):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                rows.append({"brand": brand, "model": stem, "image": os.path.join(dirpath, filename)})
+    return rows
+
+
+def import_record(row, default_brand, placeholder_path):
+    data = {"brand": (row.get("brand") or "").strip() or default_brand}
+    source = row.get("image") or placeholder_path
+    data["model"] = (row.get("model") or "").strip() or os.path.splitext(os.path.basename(source))[0]
+    for key in ("year", "bought_value", "internet_value"):
+        value = row.get(key)
+        data[key] = float(value) if value not in (None, "") else 0.0
+    data["notes"] = (row.get("notes") or "").strip()
+    data["open_state"] = "Open" if str(row.get("open_state", "")).strip().lower() == "open" else "Cased"
+    return source, new_car_record(data)
+
+
+def import_worker(task):
+    # Also returns its duration, since spans recorded in a pool process are lost with it.
+    index, source = task
+    start = time.perf_counter()
+    try:
+        return index, ingest_image(source), None, time.perf_counter() - start
+    except Exception as e:
+        return index, None, f"{os.path.basename(source)}: {e}", time.perf_counter() - start
+
+
+def load_import_progress():
+    if not os.path.exists(IMPORT_PROGRESS_FILE):
+        return None, {}
+    header = None
+    done = {}
+    with open(IMPORT_PROGRESS_FILE, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # torn final line from an interrupted write
+            if header is None:
+                header = entry
+            else:
+                done[entry["source"]] = Car.from_dict(entry["record"])
+    return header, done
+
+
+def clear_import_progress():
+    if os.path.exists(IMPORT_PROGRESS_FILE):
+        os.remove(IMPORT_PROGRESS_FILE)
+
+
+@profiler.timed("bulk_import")
+def bulk_import(source, default_brand, progress=None):
+    # Thumbnails are generated by a process pool. Every finished car is appended to
+    # IMPORT_PROGRESS_FILE, so re-running an interrupted import of the same source only
+    # processes what is left. The caller commits the returned records in one go.
+    rows = read_import_manifest(source) if os.path.isfile(source) else scan_import_folder(source, default_brand)
+    header, done = load_import_progress()
+    if header is None or header.get("source") != os.path.abspath(source):
+        done = {}
+        with open(IMPORT_PROGRESS_FILE, 'w') as f:
+            f.write(json.dumps({"source": os.path.abspath(source), "brand": default_brand}) + "\n")
+
+    placeholder_path = placeholder_image()
+    records = list(done.values())
+    failures = []
+    tasks = []
+    pending = {}
+    for index, row in enumerate(rows):
+        key = row.get("image") or f"row:{index}"
+        if key in done:
+            continue
+        try:
+            image_source, data = import_record(row, default_brand, placeholder_path)
+        except ValueError as e:
+            failures.append(f"row {index + 1}: {e}")
+            continue
+        pending[index] = (key, data)
+        tasks.append((index, image_source))
+
+    start = time.perf_counter()
+    completed = 0
+    if tasks:
+        # spawn keeps the workers independent of the caller's threads (the GUI runs this off a worker).
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(IMPORT_PROCESSES, len(tasks))) as pool, open(IMPORT_PROGRESS_FILE, 'a') as log:
+            for index, names, error, seconds in pool.imap_unordered(import_worker, tasks, chunksize=8):
+                profiler.record("import_image", seconds)
+                key, data = pending[index]
+                completed += 1
+                if error:
+                    failures.append(error)
+                else:
+                    data["image"], data["thumb"], data["phash"] = names
+                    records.append(data)
+                    log.write(json.dumps({"source": key, "record": data.to_dict()}) + "\n")
+                    log.flush()
+                if progress is not None:
+                    elapsed = time.perf_counter() - start
+                    progress(completed, len(tasks), completed / elapsed if elapsed else 0.0)
+
+    elapsed = time.perf_counter() - start
+    rate = completed / elapsed if elapsed else 0.0
+    return records, failures, rate
+
+
+class BrandRegistry:
+    # Brand names in display order plus a brand -> {car id: car} index kept up to date on every
+    # mutation, so membership, counts, in-use checks and renames never scan the catalog.
+    def __init__(self, names, catalog=()):
+        self.order = dict.fromkeys(names)
+        self.cars = {}
+        for car in catalog:
+            self.add_car(car)
+
+    def __contains__(self, name):
+        return name in self.order
+
+    def names(self):
+        return list(self.order)
+
+    def first(self):
+        return next(iter(self.order))
+
+    def add(self, name):
+        self.order[name] = None
+
+    def remove(self, name):
+        del self.order[name]
+
+    def count(self, name):
+        return len(self.cars.get(name, ()))
+
+    def in_use(self, name):
+        return bool(self.cars.get(name))
+
+    def bucket(self, name):
+        return self.cars.get(name, {})
+
+    def add_car(self, car):
+        self.cars.setdefault(car["brand"], {})[car["id"]] = car
+
+    def remove_car(self, car, brand=None):
+        brand = car["brand"] if brand is None else brand
+        cars = self.cars.get(brand)
+        if cars is not None:
+            cars.pop(car["id"], None)
+            if not cars:
+                del self.cars[brand]
+
+    def move_car(self, car, old_brand):
+        if old_brand != car["brand"]:
+            self.remove_car(car, old_brand)
+            self.add_car(car)
+
+    def rename(self, old_name, new_name):
+        # Returns the cars that were relabelled so callers can update their own indexes.
+        del self.order[old_name]
+        self.order[new_name] = None
+        cars = self.cars.pop(old_name, {})
+        for car in cars.values():
+            car["brand"] = new_name
+        if cars:
+            self.cars.setdefault(new_name, {}).update(cars)
+        return list(cars.values())
+
+
+def search_text(car, field):
+    value = car.get(field, "")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).lower()
+
+
+class SearchIndex:
+    # Per-field n-gram postings so a query only verifies cars sharing all of its n-grams.
+    # Postings hold small int doc numbers assigned in insertion order; texts shorter than
+    # NGRAM_SIZE are indexed whole. `shorter` maps each substring shorter than NGRAM_SIZE to the
+    # grams containing it, so the one- and two-character terms of the first keystrokes find their
+    # postings without a pass over the vocabulary. It grows with the vocabulary, not the catalog.
+    def __init__(self, catalog=()):
+        self.postings = {field: {} for field in SEARCH_FIELDS}
+        self.shorter = {field: defaultdict(set) for field in SEARCH_FIELDS}
+        self.docs = {}
+        self.doc_ids = {}
+        self.texts = {}
+        self._next_doc = 0
+        for car in catalog:
+            self.add(car)
+
+    @staticmethod
+    def grams(text):
+        if len(text) < NGRAM_SIZE:
+            return {text} if text else set()
+        return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+    @staticmethod
+    def substrings(gram):
+        return {gram[i:i + size] for size in range(1, NGRAM_SIZE) for i in range(len(gram) - size + 1)}
+
+    def add(self, car, doc=None):
+        if doc is None:
+            doc = self._next_doc
+            self._next_doc += 1
+        texts = tuple(search_text(car, field) for field in SEARCH_FIELDS)
+        for field, text in zip(SEARCH_FIELDS, texts):
+            postings = self.postings[field]
+            for gram in self.grams(text):
+                ids = postings.get(gram)
+                if ids is None:
+                    postings[gram] = {doc}
+                    shorter = self.shorter[field]
+                    for sub in self.substrings(gram):
+                        shorter[sub].add(gram)
+                else:
+                    ids.add(doc)
+        # The joined form lets unqualified terms be verified with a single substring test.
+        self.texts[doc] = texts + ("\0".join(texts),)
+        self.docs[doc] = car
+        self.doc_ids[car["id"]] = doc
+
+    def remove(self, car_id):
+        doc = self.doc_ids.pop(car_id, None)
+        if doc is None:
+            return None
+        for field, text in zip(SEARCH_FIELDS, self.texts.pop(doc)):
+            postings = self.postings[field]
+            for gram in self.grams(text):
+                docs = postings[gram]
+                docs.discard(doc)
+                if not docs:
+                    del postings[gram]
+                    shorter = self.shorter[field]
+                    for sub in self.substrings(gram):
+                        grams = shorter[sub]
+                        grams.discard(gram)
+                        if not grams:
+                            del shorter[sub]
+        del self.docs[doc]
+        return doc
+
+    def update(self, car):
+        self.add(car, self.remove(car["id"]))
+
+    def get(self, car_id):
+        doc = self.doc_ids.get(car_id)
+        return None if doc is None else self.docs[doc]
+
+    @staticmethod
+    def parse(query):
+        try:
+            tokens = shlex.split(query)
+        except ValueError:
+            tokens = query.split()
+        terms = []
+        for token in tokens:
+            field, sep, value = token.partition(":")
+            field = field.lower()
+            if sep and field in SEARCH_FIELDS:
+                if value:
+                    terms.append((field, value.lower()))
+            elif token:
+                terms.append((None, token.lower()))
+        return terms
+
+    def posting_sets(self, field, term):
+        # The postings a match of term in field must be in, smallest first, or None if some are
+        # empty. A term of exactly NGRAM_SIZE characters has one exact set.
+        postings = self.postings[field]
+        sets = []
+        for gram in self.grams(term):
+            ids = postings.get(gram)
+            if not ids:
+                return None
+            sets.append(ids)
+        sets.sort(key=len)
+        return sets
+
+    def short_postings(self, field, term):
+        # For a term shorter than NGRAM_SIZE: the postings of every gram containing it, whose
+        # union is exactly the texts containing it.
+        postings = self.postings[field]
+        return [postings[gram] for gram in self.shorter[field].get(term, ())]
+
+    def search(self, query):
+        docs = self.search_docs(query)
+        return None if docs is None else [self.docs[doc] for doc in docs]
+
+    @classmethod
+    def scan_docs(cls, query, docs):
+        # search_docs without an index, testing each (doc, car) in turn: cheaper than building
+        # the index for a single query.
+        terms = cls.parse(query)
+        if not terms:
+            return None
+        terms = [(len(SEARCH_FIELDS) if field is None else SEARCH_FIELDS.index(field), term) for field, term in terms]
+        result = []
+        for doc, car in docs:
+            texts = tuple(search_text(car, field) for field in SEARCH_FIELDS)
+            texts += ("\0".join(texts),)
+            if all(term in texts[i] for i, term in terms):
+                result.append(doc)
+        return sorted(result)
+
+    def search_docs(self, query):
+        # Sorted doc numbers of the matches, or None for an empty query. Terms go from the most to
+        # the least selective; the first is read from its postings and the others only narrow what
+        # is left, by intersecting postings or, for short terms, by a substring test.
+        terms = self.parse(query)
+        if not terms:
+            return None
+        plans = []
+        checks = []
+        for field, term in terms:
+            fields = SEARCH_FIELDS if field is None else (field,)
+            i = len(SEARCH_FIELDS) if field is None else SEARCH_FIELDS.index(field)
+            if len(term) < NGRAM_SIZE:
+                postings = [ids for name in fields for ids in self.short_postings(name, term)]
+                if not postings:
+                    return []
+                # Their total size bounds the matches; past the catalog size a scan is cheaper.
+                plans.append((min(sum(map(len, postings)), len(self.docs)), (term, i, postings)))
+                continue
+            options = [sets for sets in (self.posting_sets(name, term) for name in fields) if sets is not None]
+            if not options:
+                return []
+            plans.append((sum(len(sets[0]) for sets in options), options))
+            if len(term) > NGRAM_SIZE:
+                checks.append((term, i))
+        plans.sort(key=lambda plan: plan[0])
+
+        texts = self.texts
+        result = None
+        for size, options in plans:
+            if isinstance(options, tuple):
+                term, i, postings = options
+                if result is not None:
+                    result = {doc for doc in result if term in texts[doc][i]}
+                elif size < len(self.docs):
+                    result = set().union(*postings)
+                else:
+                    result = {doc for doc, text in texts.items() if term in text[i]}
+            else:
+                matches = []
+                for sets in options:
+                    ids = sets[0] if result is None else result & sets[0]
+                    for other in sets[1:]:
+                        if not ids:
+                            break
+                        ids = ids & other
+                    matches.append(ids)
+                result = matches[0].union(*matches[1:]) if len(matches) > 1 else matches[0]
+            if not result:
+                return []
+
+        for term, i in checks:
+            result = [doc for doc in result if term in texts[doc][i]]
+        return sorted(result)
+
+
+def column_value(value):
+    try:
+        return float(value or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def and_masks(masks):
+    # Masks are bytes of 0/1 per row; as big integers they AND together in a single C operation.
+    masks = [mask for mask in masks if mask is not None]
+    result = int.from_bytes(masks[0], 'little')
+    for mask in masks[1:]:
+        result &= int.from_bytes(mask, 'little')
+    return result.to_bytes(len(masks[0]), 'little')
+
+
+class CarColumns:
+    # The catalog in columns, one row per car: numeric fields in typed arrays, brands as integer
+    # codes and the open state as a 0/1 byte map. Filters build 0/1 masks with map/compress over
+    # whole columns, so selecting, sorting and totalling run no Python code per row. Rows of
+    # removed cars stay behind as dead entries so row numbers never change.
+    def __init__(self, catalog=()):
+        self.values = {field: array('d') for field in NUMERIC_FIELDS}
+        self.brand_codes = array('i')
+        self.brand_names = []
+        self.brand_lookup = {}
+        self.opened = bytearray()
+        self.live = bytearray()
+        self.cars = []
+        self.rows = {}
+        for car in catalog:
+            self.add(car)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def brand_code(self, name):
+        code = self.brand_lookup.get(name)
+        if code is None:
+            code = self.brand_lookup[name] = len(self.brand_names)
+            self.brand_names.append(name)
+        return code
+
+    def add(self, car):
+        row = len(self.cars)
+        for field, column in self.values.items():
+            column.append(column_value(car.get(field)))
+        self.brand_codes.append(self.brand_code(car.get("brand")))
+        self.opened.append(car.get("open_state") == "Open")
+        self.live.append(1)
+        self.cars.append(car)
+        self.rows[car["id"]] = row
+        return row
+
+    def update(self, car):
+        row = self.rows.get(car["id"])
+        if row is None:
+            return self.add(car)
+        for field, column in self.values.items():
+            column[row] = column_value(car.get(field))
+        self.brand_codes[row] = self.brand_code(car.get("brand"))
+        self.opened[row] = car.get("open_state") == "Open"
+        self.cars[row] = car
+        return row
+
+    def remove(self, car_id):
+        row = self.rows.pop(car_id, None)
+        if row is not None:
+            self.live[row] = 0
+            self.cars[row] = None
+        return row
+
+    def mask(self, ranges=None, only_opened=False, brand=None):
+        # ranges maps a numeric field to (low, high); either bound may be None.
+        masks = [self.live]
+        for field, (low, high) in (ranges or {}).items():
+            column = self.values[field]
+            if low is not None:
+                masks.append(bytes(map(float(low).__le__, column)))
+            if high is not None:
+                masks.append(bytes(map(float(high).__ge__, column)))
+        if only_opened:
+            masks.append(self.opened)
+        if brand is not None:
+            masks.append(bytes(map(self.brand_lookup.get(brand, -1).__eq__, self.brand_codes)))
+        return and_masks(masks)
+
+    def select(self, rows=None, ranges=None, only_opened=False, brand=None):
+        # Live rows passing the filters, in row order. rows narrows the search (e.g. to text matches).
+        mask = self.mask(ranges, only_opened, brand)
+        if rows is None:
+            return list(itertools.compress(range(len(mask)), mask))
+        return list(itertools.compress(rows, map(mask.__getitem__, rows)))
+
+    def sort(self, rows, field, reverse=False):
+        if field == "brand":
+            ranks = [0] * len(self.brand_names)
+            for rank, code in enumerate(sorted(range(len(ranks)), key=self.brand_names.__getitem__)):
+                ranks[code] = rank
+            key = array('i', map(ranks.__getitem__, self.brand_codes)).__getitem__
+        else:
+            key = self.values[field].__getitem__
+        return sorted(rows, key=key, reverse=reverse)
+
+    def cars_at(self, rows):
+        return list(map(self.cars.__getitem__, rows))
+
+    def total(self, field, rows=None):
+        column = self.values[field]
+        if rows is None:
+            return sum(itertools.compress(column, self.live))
+        return sum(map(column.__getitem__, rows))
+
+
+def popcount(value):
+    return bin(value).count("1")
+
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count  # Python 3.10+
+
+
+def hash_distance(a, b):
+    return popcount(a ^ b)
+
+
+def hash_probes(width, radius):
+    # Every mask of `width` bits with at most `radius` bits set, the exact match first.
+    return [sum(1 << bit for bit in bits)
+            for r in range(radius + 1) for bits in itertools.combinations(range(width), r)]
+
+
+class ImageHashIndex:
+    # Multi-index hash table over the perceptual hashes of the stored images, with the cars using
+    # each. The hash is cut into PHASH_SEGMENTS parts, each with a table of its own. Two hashes
+    # within DUPLICATE_DISTANCE bits differ in at most DUPLICATE_DISTANCE // PHASH_SEGMENTS bits
+    # in one of the parts, so probing each table with that many bit flips finds every near match
+    # without comparing against the whole collection.
+    def __init__(self, catalog=()):
+        self.width = PHASH_SIZE * PHASH_SIZE // PHASH_SEGMENTS
+        self.probes = hash_probes(self.width, DUPLICATE_DISTANCE // PHASH_SEGMENTS)
+        self.hashes = {}
+        self.cars = {}
+        self.tables = [defaultdict(set) for _ in range(PHASH_SEGMENTS)]
+        for car in catalog:
+            self.add(car)
+
+    def parts(self, value):
+        mask = (1 << self.width) - 1
+        return [(value >> (i * self.width)) & mask for i in range(PHASH_SEGMENTS)]
+
+    def add(self, car):
+        # Flat images such as the placeholder hash to 0 and say nothing about the car, so they
+        # are left out.
+        image = car.get("image")
+        phash = car.get("phash")
+        if not image or not phash or not int(phash, 16):
+            return
+        if image not in self.cars:
+            value = int(phash, 16)
+            self.hashes[image] = value
+            self.cars[image] = {}
+            for table, part in zip(self.tables, self.parts(value)):
+                table[part].add(image)
+        self.cars[image][car["id"]] = car
+
+    def remove(self, car):
+        image = car.get("image")
+        cars = self.cars.get(image)
+        if cars is None or cars.pop(car["id"], None) is None or cars:
+            return
+        del self.cars[image]
+        for table, part in zip(self.tables, self.parts(self.hashes.pop(image))):
+            table[part].discard(image)
+            if not table[part]:
+                del table[part]
+
+    def near(self, value):
+        # The indexed images within DUPLICATE_DISTANCE of `value`, with their distances.
+        found = {}
+        for table, part in zip(self.tables, self.parts(value)):
+            for probe in self.probes:
+                for image in table.get(part ^ probe, ()):
+                    if image not in found:
+                        found[image] = hash_distance(self.hashes[image], value)
+        return {image: distance for image, distance in found.items() if distance <= DUPLICATE_DISTANCE}
+
+    def similar(self, car):
+        # Other cars whose image is the same as or near-identical to this car's, closest first.
+        phash = car.get("phash")
+        if not phash or not int(phash, 16):
+            return []
+        near = sorted(self.near(int(phash, 16)).items(), key=lambda item: item[1])
+        return [other for image, distance in near for other in self.cars[image].values() if other is not car]
+
+    def groups(self):
+        # Likely duplicates: images joined by near matches (transitively) and the cars using them,
+        # as lists of two or more cars, largest first. Rather than querying image by image, every
+        # bucket of a table is compared with the buckets a probe away, each pair of buckets once.
+        parent = {image: image for image in self.hashes}
+
+        def find(image):
+            while parent[image] != image:
+                parent[image] = parent[parent[image]]
+                image = parent[image]
+            return image
+
+        hashes = self.hashes
+        for table in self.tables:
+            for part, images in table.items():
+                values = [(image, hashes[image]) for image in images]
+                for probe in self.probes:
+                    if part ^ probe < part:
+                        continue
+                    others = table.get(part ^ probe)
+                    if not others:
+                        continue
+                    for other in others:
+                        other_value = hashes[other]
+                        for image in [image for image, value in values
+                                      if popcount(value ^ other_value) <= DUPLICATE_DISTANCE and image != other]:
+                            root, other_root = find(image), find(other)
+                            if root != other_root:
+                                parent[other_root] = root
+        members = defaultdict(list)
+        for image, cars in self.cars.items():
+            members[find(image)].extend(cars.values())
+        return sorted((cars for cars in members.values() if len(cars) > 1), key=len, reverse=True)
+
+
+def cents(value):
+    return round(column_value(value) * 100)
+
+
+def value_bucket_label(index):
+    low = VALUE_BUCKETS[index]
+    return f"{low}+" if index == len(VALUE_BUCKETS) - 1 else f"{low}-{VALUE_BUCKETS[index + 1]}"
+
+
+class CatalogStats:
+    # Running aggregates over the catalog, adjusted one car at a time on every add, edit and
+    # delete so reading them never scans. Each car's last contribution is remembered so an edit
+    # can take it back out; money is summed in integer cents so repeated updates do not drift.
+    def __init__(self, catalog=()):
+        self.entries = {}
+        self.count = 0
+        self.bought = 0
+        self.internet = 0
+        self.brands = {}
+        self.years = Counter()
+        self.states = Counter()
+        self.values = Counter()
+        for car in catalog:
+            self.add(car)
+
+    def add(self, car):
+        entry = (car.get("brand"), int(column_value(car.get("year"))), cents(car.get("bought_value")),
+                 cents(car.get("internet_value")), car.get("open_state") == "Open")
+        self.entries[car["id"]] = entry
+        self._apply(entry, 1)
+
+    def remove(self, car_id):
+        entry = self.entries.pop(car_id, None)
+        if entry is not None:
+            self._apply(entry, -1)
+
+    def update(self, car):
+        self.remove(car["id"])
+        self.add(car)
+
+    def _apply(self, entry, sign):
+        brand, year, bought, internet, opened = entry
+        self.count += sign
+        self.bought += sign * bought
+        self.internet += sign * internet
+        totals = self.brands.setdefault(brand, [0, 0, 0])
+        totals[0] += sign
+        totals[1] += sign * bought
+        totals[2] += sign * internet
+        if not totals[0]:
+            del self.brands[brand]
+        bucket = max(bisect.bisect_right(VALUE_BUCKETS, internet / 100) - 1, 0)
+        for counter, key in ((self.years, year), (self.states, "Open" if opened else "Cased"),
+                             (self.values, bucket)):
+            counter[key] += sign
+            if not counter[key]:
+                del counter[key]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "bought_value": self.bought / 100,
+            "internet_value": self.internet / 100,
+            "gain": (self.internet - self.bought) / 100,
+            "brands": {brand: {"count": count, "bought_value": bought / 100, "internet_value": internet / 100,
+                               "gain": (internet - bought) / 100}
+                       for brand, (count, bought, internet) in self.brands.items()},
+            "years": dict(sorted(self.years.items())),
+            "states": {state: self.states[state] for state in ("Cased", "Open")},
+            "values": [(value_bucket_label(i), self.values[i]) for i in range(len(VALUE_BUCKETS))],
+        }
+
+
+GALLERY_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: Arial, sans-serif; margin: 20px; color: #222; }}
+.grid {{ display: flex; flex-wrap: wrap; gap: 10px; }}
+figure {{ width: 150px; margin: 0; text-align: center; font-size: 12px; }}
+figure img {{ width: 100px; height: 100px; object-fit: contain; }}
+.totals {{ color: #555; border-top: 1px solid #ccc; padding-top: 5px; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+
+
+def format_money(value_cents):
+    return f"{value_cents / 100:,.2f}"
+
+
+def totals_text(count, bought, internet):
+    return (f"{count} car(s), bought {format_money(bought)}, internet {format_money(internet)}, "
+            f"gain {'+' if internet >= bought else '-'}{format_money(abs(internet - bought))}")
+
+
+def gallery_card(car, thumb_url):
+    year = int(column_value(car.get("year")))
+    details = " &middot; ".join(html.escape(str(part)) for part in (year or "", car.get("open_state")) if part)
+    return (f'<figure><img src="{thumb_url}" alt="" loading="lazy"><figcaption><b>'
+            f'{html.escape(car.get("model") or "")}</b><br>{details}<br>'
+            f'bought {format_money(cents(car.get("bought_value")))} &middot; '
+            f'internet {format_money(cents(car.get("internet_value")))}</figcaption></figure>\n')
+
+
+def copy_thumbnail(name, folder):
+    # Thumbnail names are content hashes, so one already copied by an earlier export is current.
+    dest = os.path.join(folder, name)
+    if os.path.exists(dest):
+        return
+    tmp_path = partial_path(dest)
+    try:
+        shutil.copyfile(os.path.join(THUMB_DIR, name), tmp_path)
+    except FileNotFoundError:
+        return  # rebuilt by the image check; the card shows without it meanwhile
+    os.replace(tmp_path, dest)
+
+
+def write_gallery(cars, f, files_dir, progress=None):
+    # Streams one section per brand, each closed with its totals, and copies the thumbnails next
+    # to the page on a thread pool while the cards are written. At most a few copies per thread
+    # are in flight, so memory stays flat however many cars are exported.
+    os.makedirs(files_dir, exist_ok=True)
+    files_url = quote(os.path.basename(files_dir))
+    f.write(GALLERY_HEAD.format(title="Hot Wheels Catalog"))
+    copied = set()
+    pending = deque()
+    total = [0, 0, 0]
+    section = None
+    brand = None
+    with ThreadPoolExecutor(EXPORT_COPY_THREADS) as pool:
+        # Stable, so each brand keeps the order it was given in.
+        for done, car in enumerate(sorted(cars, key=lambda car: car.get("brand") or ""), 1):
+            if section is None or car.get("brand") != brand:
+                if section is not None:
+                    f.write(f'</div>\n<p class="totals">{totals_text(*section)}</p>\n</section>\n')
+                brand = car.get("brand")
+                section = [0, 0, 0]
+                f.write(f'<section>\n<h2>{html.escape(brand or "")}</h2>\n<div class="grid">\n')
+            bought, internet = cents(car.get("bought_value")), cents(car.get("internet_value"))
+            for totals in (section, total):
+                totals[0] += 1
+                totals[1] += bought
+                totals[2] += internet
+            thumb = car.get("thumb") or ""
+            if thumb and thumb not in copied:
+                copied.add(thumb)
+                pending.append(pool.submit(copy_thumbnail, thumb, files_dir))
+                if len(pending) > EXPORT_COPY_THREADS * 4:
+                    pending.popleft().result()
+            f.write(gallery_card(car, f"{files_url}/{quote(thumb)}"))
+            if progress is not None and not done % EXPORT_PROGRESS_EVERY:
+                progress(done, len(cars))
+        while pending:
+            pending.popleft().result()
+    if section is not None:
+        f.write(f'</div>\n<p class="totals">{totals_text(*section)}</p>\n</section>\n')
+    f.write(f'<p class="totals"><b>Total: {totals_text(*total)}</b></p>\n</body>\n</html>\n')
+
+
+@profiler.timed("export")
+def export_cars(cars, path, fmt=None, progress=None):
+    # Writes the cars (usually a query result, so the search box's filters apply) one record at a
+    # time. An HTML gallery also copies the thumbnails into a "<name>_files" folder beside it.
+    # Returns the number of cars written.
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt == "htm":
+        fmt = "html"
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'.")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == "html":
+            write_gallery(cars, f, os.path.splitext(path)[0] + "_files", progress)
+        else:
+            if fmt == "csv":
+                writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                write = writer.writerow
+            elif fmt == "jsonl":
+                def write(car):
+                    f.write(json.dumps(car.to_dict()) + "\n")
+            else:
+                f.write("[")
+
+                def write(car):
+                    f.write(("\n    " if done == 1 else ",\n    ") +
+                            json.dumps(car.to_dict(), indent=4).replace("\n", "\n    "))
+            done = 0
+            for done, car in enumerate(cars, 1):
+                write(car)
+                if progress is not None and not done % EXPORT_PROGRESS_EVERY:
+                    progress(done, len(cars))
+            if fmt == "json":
+                f.write("\n]" if done else "]")
+    os.replace(tmp_path, path)
+    profiler.count("records_exported", len(cars))
+    return len(cars)
+
+
+class AddCars:
+    # The undoable edits below are applied through Catalog.execute, which keeps them in its
+    # History. `images` are the stored images a command can bring back on undo or redo; the
+    # history keeps them referenced so they are not collected while it can. `cars` are the
+    # records it touches.
+    def __init__(self, cars, label="Add"):
+        self.cars = list(cars)
+        self.label = label
+        self.images = [car.get("image") for car in self.cars]
+
+    def apply(self, catalog):
+        for car in self.cars:
+            catalog.insert(car)
+        catalog.persist(changed=self.cars)
+
+    def revert(self, catalog):
+        catalog.remove_cars(self.cars)
+        catalog.persist(deleted=[car["id"] for car in self.cars])
+
+
+class DeleteCars(AddCars):
+    def __init__(self, cars, label="Delete"):
+        super().__init__(cars, label)
+
+    apply, revert = AddCars.revert, AddCars.apply
+
+
+class EditCars:
+    def __init__(self, edits, label="Edit"):
+        # edits is a list of (car, changes); the values being replaced are kept for undo.
+        self.edits = [(car, changes, {key: car[key] for key in changes if key in car}) for car, changes in edits]
+        self.cars = [car for car, changes, old in self.edits]
+        self.label = label
+        self.images = ()
+
+    def apply(self, catalog):
+        for car, changes, old in self.edits:
+            catalog.change_car(car, changes)
+        catalog.persist(changed=self.cars)
+
+    def revert(self, catalog):
+        for car, changes, old in self.edits:
+            for key in changes.keys() - old.keys():
+                del car[key]
+            catalog.change_car(car, old)
+        catalog.persist(changed=self.cars)
+
+
+class ChangeImage:
+    def __init__(self, car, image, thumb, phash=None):
+        self.car = car
+        self.cars = [car]
+        self.new = (image, thumb, phash)
+        self.old = (car.get("image"), car.get("thumb"), car.get("phash"))
+        self.label = "Change image"
+        self.images = (image, self.old[0])
+
+    def apply(self, catalog):
+        catalog.set_image(self.car, *self.new)
+        catalog.persist(changed=self.cars)
+
+    def revert(self, catalog):
+        catalog.set_image(self.car, *self.old)
+        catalog.persist(changed=self.cars)
+
+
+class RenameBrand:
+    def __init__(self, old_name, new_name):
+        self.old_name = old_name
+        self.new_name = new_name
+        self.cars = ()
+        self.label = "Rename brand"
+        self.images = ()
+
+    def apply(self, catalog):
+        catalog.relabel_brand(self.old_name, self.new_name)
+
+    def revert(self, catalog):
+        catalog.relabel_brand(self.new_name, self.old_name)
+
+
+class History:
+    # Undo and redo stacks of applied commands, the oldest dropped beyond `limit`.
+    def __init__(self, images, limit=UNDO_LIMIT):
+        self.images = images
+        self.limit = limit
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def push(self, command):
+        self._drop(self.redo_stack)
+        self.redo_stack = []
+        for name in command.images:
+            self.images.add(name)
+        self.undo_stack.append(command)
+        if len(self.undo_stack) > self.limit:
+            self._drop([self.undo_stack.pop(0)])
+
+    def _drop(self, commands):
+        for command in commands:
+            for name in command.images:
+                self.images.release(name)
+
+    def clear(self):
+        self._drop(self.undo_stack + self.redo_stack)
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def undo(self, catalog):
+        # A command that fails to revert stays where it was.
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack[-1]
+        command.revert(catalog)
+        self.redo_stack.append(self.undo_stack.pop())
+        return command
+
+    def redo(self, catalog):
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack[-1]
+        command.apply(catalog)
+        self.undo_stack.append(self.redo_stack.pop())
+        return command
+
+
+class Catalog:
+    # The catalog engine: the records, the search index and brand registry kept in step with
+    # them, and the store they are committed to. The GUI and the CLI are both clients of it.
+    # With stream=True nothing is read up front: the caller pulls batches with read_batch (on
+    # any one thread) and hands them to add_loaded (on the thread that uses the catalog).
+    # Edits are recorded by persist and written by flush: straight away unless on_dirty is set,
+    # in which case the caller is told and picks the moment, so a burst of edits is one write.
+    # A store with lazy_brands is read a brand at a time instead: `unloaded` holds the brands not
+    # read yet with their counts, and with stream=True they stay unloaded until asked for.
+    # With lazy_indexes the search index, totals and image hashes are built on first use, so a
+    # one-off command that only lists or counts does not pay for tokenizing every record.
+    def __init__(self, stream=False, lazy_indexes=False):
+        ensure_dirs()
+        self.cars = []
+        self.brands = BrandRegistry(load_brands())
+        self.columns = CarColumns()
+        self._search_index = None if lazy_indexes else SearchIndex()
+        self._totals = None if lazy_indexes else CatalogStats()
+        self._image_hashes = None if lazy_indexes else ImageHashIndex()
+        self._scanned = False
+        self.images = ImageStore()
+        self.history = History(self.images)
+        self.pending_adds = set()
+        self._image_holds = 0
+        self.loading = True
+        self._loader = iter_catalog()
+        self.unloaded = {}
+        self._renamed = {}
+        self._rewrite = False
+        self._changed = {}
+        self._deleted = set()
+        self.on_dirty = None
+        self._load_start = time.perf_counter()
+        if catalog_store().lazy_brands:
+            self.unloaded = catalog_store().brand_counts()
+            self.loading = False
+            self._loader = None
+            if not stream:
+                self.load_all()
+        elif not stream:
+            self.add_loaded(*self.read_batch())
+
+    @profiler.timed("read_batch")
+    def read_batch(self, count=None):
+        # Only parses records, so it is safe on a worker thread. Returns the batch and whether
+        # the store is exhausted.
+        if self._loader is None:
+            return [], True
+        batch = list(itertools.islice(self._loader, count))
+        done = count is None or len(batch) < count
+        if done:
+            self._loader = None
+        return batch, done
+
+    @profiler.timed("index_batch")
+    def add_loaded(self, batch, done):
+        profiler.count("records_loaded", len(batch))
+        renamed = self._renamed
+        for car in batch:
+            if renamed and car["brand"] in renamed:
+                car["brand"] = renamed[car["brand"]]
+            self.insert(car)
+        if done and self.loading:
+            self.loading = False
+            profiler.record("load_catalog", time.perf_counter() - self._load_start)
+            self._renamed = {}
+            if self.dirty:
+                self.flush()
+            self.collect_images()
+
+    def read_shard(self, brand):
+        # Like read_batch, only parses, so it is safe on a worker thread.
+        return list(catalog_store().read_shard(brand))
+
+    @profiler.timed("index_shard")
+    def add_shard(self, brand, cars):
+        # A shard loaded meanwhile is ignored, as is one whose brand has since been renamed (it is
+        # read again under the new name).
+        if brand not in self.unloaded:
+            return
+        del self.unloaded[brand]
+        catalog_store().mark_loaded(brand)
+        profiler.count("records_loaded", len(cars))
+        for car in cars:
+            self.insert(car)
+        if self.complete:
+            if self.dirty:
+                self.flush()
+            self.collect_images()
+
+    def load_brand(self, brand):
+        if brand in self.unloaded:
+            self.add_shard(brand, self.read_shard(brand))
+
+    def load_all(self):
+        for brand in list(self.unloaded):
+            self.load_brand(brand)
+
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            with profiler.span("build_search_index"):
+                index = SearchIndex()
+                for row in self.columns.rows.values():
+                    index.add(self.columns.cars[row], row)
+            self._search_index = index
+        return self._search_index
+
+    @property
+    def totals(self):
+        if self._totals is None:
+            self._totals = CatalogStats(self.cars)
+        return self._totals
+
+    @property
+    def image_hashes(self):
+        if self._image_hashes is None:
+            self._image_hashes = ImageHashIndex(self.cars)
+        return self._image_hashes
+
+    @property
+    def complete(self):
+        # Every record is in memory: nothing is streaming in and no brand is left unloaded.
+        return not self.loading and not self.unloaded
+
+    @property
+    def dirty(self):
+        return bool(self._rewrite or self._changed or self._deleted)
+
+    def persist(self, changed=None, deleted=None):
+        # With neither given the whole store is rewritten on the next flush.
+        if changed is None and deleted is None:
+            self._rewrite = True
+        for car in changed or ():
+            self._changed[car["id"]] = car
+            self._deleted.discard(car["id"])
+        for car_id in deleted or ():
+            self._changed.pop(car_id, None)
+            self._deleted.add(car_id)
+        if self.on_dirty is None:
+            self.flush()
+        else:
+            self.on_dirty()
+
+    def flush(self):
+        if not self.complete and (self._rewrite or not catalog_store().partial_commits):
+            # Rewriting the whole store now would drop the records that have not streamed in yet;
+            # add_loaded flushes once they have.
+            return
+        if self._rewrite:
+            save_catalog(self.cars, exclude=self.pending_adds)
+            profiler.count("records_written", len(self.cars))
+        elif self._changed or self._deleted:
+            save_catalog(self.cars, list(self._changed.values()), list(self._deleted), exclude=self.pending_adds)
+            profiler.count("records_written", len(self._changed) + len(self._deleted))
+        self._rewrite = False
+        self._changed = {}
+        self._deleted = set()
+
+    def close(self):
+        # The images only the history still references (deleted cars, replaced photos) are
+        # collected here; the next session rebuilds the references from the records alone and
+        # would never collect them. Nothing is collected unless every edit was written.
+        self.flush()
+        self.history.clear()
+        if not self.dirty:
+            self.collect_images()
+
+    def execute(self, command):
+        # Collection is held while the command runs, since it may drop the last reference to an
+        # image that the history is about to keep for undo.
+        profiler.count("commands")
+        self.hold_images()
+        try:
+            command.apply(self)
+            self.history.push(command)
+        finally:
+            self.release_images()
+        return command
+
+    def record(self, command):
+        # For a command whose effect the caller has already applied.
+        self.history.push(command)
+
+    def undo(self):
+        self.hold_images()
+        try:
+            return self.history.undo(self)
+        finally:
+            self.release_images()
+
+    def redo(self):
+        self.hold_images()
+        try:
+            return self.history.redo(self)
+        finally:
+            self.release_images()
+
+    def get(self, car_id):
+        row = self.columns.rows.get(car_id)
+        return None if row is None else self.columns.cars[row]
+
+    def search(self, query):
+        return self.query(query)
+
+    @profiler.timed("query")
+    def query(self, text="", ranges=None, only_opened=False, brand=None, sort=None, reverse=False):
+        # Text search narrows the rows first (search docs are column rows), then the column filters
+        # and sort apply to what is left. Only loaded brands are searched.
+        if not text.strip():
+            docs = None
+        elif self._search_index is None and not self._scanned:
+            # Without an index yet, one query is answered by a scan; a second builds the index.
+            self._scanned = True
+            docs = SearchIndex.scan_docs(text, ((row, self.columns.cars[row]) for row in self.columns.rows.values()))
+        else:
+            docs = self.search_index.search_docs(text)
+        rows = self.columns.select(docs, ranges, only_opened, brand)
+        if sort:
+            rows = self.columns.sort(rows, sort, reverse)
+        return self.columns.cars_at(rows)
+
+    def insert(self, car):
+        # A brand is read in before a car joins it, so its shard is never written without the rest.
+        if self.unloaded and car["brand"] in self.unloaded:
+            self.load_brand(car["brand"])
+        self.cars.append(car)
+        row = self.columns.add(car)
+        if self._search_index is not None:
+            self._search_index.add(car, row)
+        if self._totals is not None:
+            self._totals.add(car)
+        if self._image_hashes is not None:
+            self._image_hashes.add(car)
+        self.images.add(car.get("image"))
+        self.brands.add_car(car)
+
+    def reindex(self, car, fields=None):
+        # Re-tokenizing is the costly part, so the search index is left alone when none of the
+        # changed fields are searchable.
+        if self._search_index is not None and (fields is None or not _SEARCH_FIELD_SET.isdisjoint(fields)):
+            self._search_index.update(car)
+        self.columns.update(car)
+        if self._totals is not None:
+            self._totals.update(car)
+
+    def remove_cars(self, cars):
+        ids = {car['id'] for car in cars}
+        self.cars = [c for c in self.cars if c['id'] not in ids]
+        for car in cars:
+            if self._search_index is not None:
+                self._search_index.remove(car['id'])
+            self.columns.remove(car['id'])
+            if self._totals is not None:
+                self._totals.remove(car['id'])
+            if self._image_hashes is not None:
+                self._image_hashes.remove(car)
+            self.images.release(car.get("image"))
+            self.brands.remove_car(car)
+
+    def change_car(self, car, changes):
+        if "brand" in changes:
+            self.load_brand(changes["brand"])
+        old_brand = car["brand"]
+        car.update(changes)
+        self.reindex(car, changes)
+        self.brands.move_car(car, old_brand)
+
+    def new_car(self, data, source=None):
+        # The record is live in memory but kept out of the store until confirm_car, so its image
+        # can be ingested first, possibly on another thread. Returns the car and its image source.
+        source = source or placeholder_image()
+        car = new_car_record(data)
+        self.pending_adds.add(car["id"])
+        self.insert(car)
+        return car, source
+
+    def confirm_car(self, car, image, thumb, phash=None):
+        self.pending_adds.discard(car["id"])
+        self.set_image(car, image, thumb, phash)
+        self.persist(changed=[car])
+        self.record(AddCars([car]))
+
+    def set_image(self, car, image, thumb, phash=None):
+        old_image = car.get("image")
+        if self._image_hashes is not None:
+            self._image_hashes.remove(car)
+        car["image"] = image
+        car["thumb"] = thumb
+        if phash:
+            car["phash"] = phash
+        else:
+            car.pop("phash", None)
+        if self._image_hashes is not None:
+            self._image_hashes.add(car)
+        self.images.add(image)
+        self.images.release(old_image)
+        self.collect_images()
+
+    def hold_images(self):
+        # Ingests in flight may have found their content already stored, so nothing is collected
+        # until every hold is released.
+        self._image_holds += 1
+
+    def release_images(self):
+        self._image_holds -= 1
+        self.collect_images()
+
+    def collect_images(self):
+        # While loading, references from records that have not been read yet are unknown.
+        if not self.complete or self._image_holds:
+            return []
+        return self.images.collect()
+
+    def remove_orphans(self, paths):
+        # paths come from a scan_images report. The scan ran on a snapshot, so anything that has
+        # gained a reference since is kept, and nothing is removed while an ingest may be about to
+        # reuse a stored file.
+        if not self.complete or self._image_holds:
+            raise ValueError("Images are still being processed; try again in a moment.")
+        referenced = {path for name in self.images.refs for path in image_file_paths(name)}
+        removed = []
+        for path in paths:
+            if path not in referenced and os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    def similar_cars(self, car):
+        return self.image_hashes.similar(car)
+
+    def find_duplicates(self):
+        return self.image_hashes.groups()
+
+    def unhashed_images(self):
+        return sorted({car["image"] for car in self.cars if car.get("image") and not car.get("phash")})
+
+    def set_hashes(self, hashes):
+        # Stores backfilled hashes (see backfill_hashes) with the records still using those images.
+        # Not an undoable edit: it only fills in what ingest records for new images.
+        changed = []
+        for car in self.cars:
+            phash = hashes.get(car.get("image"))
+            if phash and not car.get("phash"):
+                car["phash"] = phash
+                if self._image_hashes is not None:
+                    self._image_hashes.add(car)
+                changed.append(car)
+        if changed:
+            self.persist(changed=changed)
+        return changed
+
+    def discard_car(self, car):
+        self.pending_adds.discard(car["id"])
+        self.remove_cars([car])
+
+    def add_car(self, data, source=None):
+        car, source = self.new_car(data, source)
+        try:
+            names = ingest_image(source)
+        except BaseException:
+            self.discard_car(car)
+            raise
+        self.confirm_car(car, *names)
+        return car
+
+    def add_records(self, records):
+        # Brands the records introduce are added for good; undo only takes the cars out again.
+        for car in records:
+            if car["brand"] not in self.brands:
+                self.brands.add(car["brand"])
+        save_brands(self.brands.names())
+        self.execute(AddCars(records, "Import"))
+
+    def update_car(self, car, changes):
+        self.execute(EditCars([(car, changes)]))
+
+    def edit_cars(self, cars, updates):
+        # One command for the whole selection: a single persist and a single undo step.
+        brand = updates.get("brand")
+        if brand is not None and brand[1] not in self.brands:
+            raise ValueError(f"'{brand[1]}' is not in the brand list.")
+        return self.execute(EditCars(batch_edits(cars, updates), "Batch edit"))
+
+    def change_image(self, car, image, thumb, phash=None):
+        self.execute(ChangeImage(car, image, thumb, phash))
+
+    def duplicate_car(self, car):
+        # The copy shares the original's stored image.
+        new_car = new_car_record(car)
+        self.execute(AddCars([new_car], "Duplicate"))
+        return new_car
+
+    def delete_car(self, car):
+        self.execute(DeleteCars([car]))
+
+    def add_brand(self, name, logo=None):
+        name = name.strip()
+        if not name:
+            raise ValueError("Brand name cannot be empty.")
+        if name in self.brands:
+            raise ValueError(f"'{name}' already exists.")
+        self.brands.add(name)
+        save_brands(self.brands.names())
+        if logo:
+            self.set_brand_logo(name, logo)
+        return name
+
+    def delete_brand(self, name):
+        if self.loading:
+            raise ValueError("The catalog is still loading; try again in a moment.")
+        if name not in self.brands:
+            raise ValueError(f"'{name}' is not in the brand list.")
+        if self.brands.in_use(name) or self.unloaded.get(name):
+            raise ValueError(f"Cannot delete '{name}' — it's in use by existing cars.")
+        self.brands.remove(name)
+        save_brands(self.brands.names())
+
+    def rename_brand(self, old_name, new_name):
+        new_name = new_name.strip() or old_name
+        if old_name not in self.brands:
+            raise ValueError(f"'{old_name}' is not in the brand list.")
+        if new_name == old_name:
+            return new_name
+        if new_name in self.brands:
+            raise ValueError(f"'{new_name}' already exists.")
+        self.execute(RenameBrand(old_name, new_name))
+        return new_name
+
+    def relabel_brand(self, old_name, new_name):
+        if new_name in self.brands:
+            raise ValueError(f"'{new_name}' already exists.")
+        for car in self.brands.rename(old_name, new_name):
+            self.reindex(car)
+        if old_name in self.unloaded:
+            self.unloaded[new_name] = self.unloaded.pop(old_name)
+        if self.loading:
+            # Cars of this brand that have not streamed in yet are relabelled as they arrive.
+            for key, value in self._renamed.items():
+                if value == old_name:
+                    self._renamed[key] = new_name
+            self._renamed[old_name] = new_name
+        if catalog_store().partial_commits:
+            # One statement or shard rename, which also covers records that have not been read yet.
+            rename_catalog_brand(self.cars, old_name, new_name, exclude=self.pending_adds)
+        else:
+            self.persist()
+        save_brands(self.brands.names())
+        logo = find_brand_logo(old_name)
+        if logo:
+            shutil.move(logo, brand_logo_path(new_name, os.path.splitext(logo)[1]))
+
+    def set_brand_logo(self, brand, source):
+        shutil.copy(source, brand_logo_path(brand, os.path.splitext(source)[1]))
+
+    def stats(self):
+        return self.totals.summary()
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import HotWheelsCore
+from HotWheelsCore import Catalog, reset_catalog_store
+
+
+class PendingCarTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.backend = HotWheelsCore.STORAGE_BACKEND
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        reset_catalog_store()
+
+    def tearDown(self):
+        HotWheelsCore.STORAGE_BACKEND = self.backend
+        reset_catalog_store()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_batch_edited_pending_car_is_not_stored(self):
+        for backend in ("sqlite", "json", "shards"):
+            with self.subTest(backend=backend):
+                HotWheelsCore.STORAGE_BACKEND = backend
+                reset_catalog_store()
+                catalog = Catalog()
+                brand = catalog.brands.first()
+                stored = catalog.add_car({"brand": brand, "model": f"Stored {backend}"})
+                pending, source = catalog.new_car({"brand": brand, "model": f"Pending {backend}"})
+                # The batch edit persists both cars while the new one's image is still being ingested.
+                catalog.edit_cars([stored, pending], {"notes": ("append", "edited")})
+                catalog.discard_car(pending)
+                catalog.flush()
+
+                reset_catalog_store()
+                ids = {car["id"] for car in Catalog().cars}
+                self.assertIn(stored["id"], ids)
+                self.assertNotIn(pending["id"], ids)
+
+
+if __name__ == "__main__":
+    unittest.main()